@@ -1,16 +1,212 @@
-import requests, pandas, os, sys
+import pandas, os, sys, argparse, asyncio, threading, concurrent.futures
+import numpy as np
 from matplotlib.dates import num2date, date2num
 from datetime import datetime, timedelta
 
-from FinanceAuth import tokenAlphaVantage as apikey
-import BasicFinance, FinanceDatabase, FinancePlot
+# Decode JSON with orjson when it is installed, since full daily histories are several megabytes:
+try: from orjson import loads
+except ImportError: from json import loads
+
+# Create a file called FinanceAuth.py containing a definition for the token
+try: from FinanceAuth import tokenAlphaVantage as apikey
+except ImportError: apikey = None
+import BasicFinance, FinanceDatabase, FinancePlot, FinanceHTTP, RateLimiter
 
 function = "TIME_SERIES_DAILY" # "TIME_SERIES_DAILY_ADJUSTED" is a premium endpoint now
 
+# Data dict keys and JSON fields of every daily bar for each time series function:
+dailyFields = {"TIME_SERIES_DAILY":          [('Open', '1. open'), ('High', '2. high'), ('Low', '3. low'), ('Close', '4. close'),
+                                              ('Volume', '5. volume')],
+               "TIME_SERIES_DAILY_ADJUSTED": [('Open', '1. open'), ('High', '2. high'), ('Low', '3. low'), ('Close', '4. close'),
+                                              ('AdjClose', '5. adjusted close'), ('Volume', '6. volume'),
+                                              ('DivAmnt', '7. dividend amount'), ('SplCoeff', '8. split coefficient')]}
+
+# Query endpoint, which can point at a local server replaying recorded responses:
+url = os.environ.get('ALPHAVANTAGE_URL', 'https://www.alphavantage.co/query')
+
+# Directory holding the price store and the rate limiter database:
+datadir = os.path.dirname(os.path.realpath(__file__))
+
+# Free tier request limits as (requests, seconds), shared by every process through the limiter database:
+ratelimits = [(5, 60.), (25, 24*60*60.)]
+ratewait   = 120. # Longest wait in seconds before a request is given up
+limiter    = None
+limiterLock = threading.Lock()
+
+# Return the shared limiter, opening its database on the first request so importing this module creates no files:
+def getLimiter():
+    global limiter
+    with limiterLock:
+        if limiter is None:
+            limiter = RateLimiter.RateLimiter(os.path.join(datadir, 'ratelimit.db'), 'AlphaVantage', ratelimits)
+        return limiter
+
+# Full histories loaded during this run, keyed by (symbol, function). Each entry is the start date the history
+# covers and a Future, so that concurrent requesters of one symbol wait on a single fetch and later instances
+# slice its arrays. Histories start at seriesStart unless a window reaching further back reloads them from there:
+seriesStart = datetime(1990, 1, 1)
+series      = {}
+seriesLock  = threading.Lock()
+
+# Serve a request from the response cache or send it once the shared rate limit allows, returning
+# None if the wait would be too long or the response is not cached while offline:
+def request(params):
+    if params['function'] == 'TIME_SERIES_DAILY' or params['function'] == 'TIME_SERIES_DAILY_ADJUSTED': endpoint = 'alphavantage-daily'
+    else:                                                                                              endpoint = 'alphavantage-intraday'
+    try:
+        return FinanceHTTP.get(url, params=params, cache=endpoint, throttle=lambda: getLimiter().acquire(ratewait), valid=lambda r: b'"Meta Data"' in r.content[:100] or b'"data"' in r.content[:200])
+    except (RateLimiter.RateLimitError, FinanceHTTP.OfflineError) as e:
+        print(e)
+        return None
+
+# Decode a JSON response, printing any message sent instead of data and returning None for it:
+def decode(resp):
+    if resp is None or resp.status_code != 200: return None
+
+    raw = loads(resp.content)
+    if len(raw.keys()) == 1 and 'Information' in raw.keys():
+        print(raw['Information'])
+    elif len(raw.keys()) == 1 and 'Note' in raw.keys():
+        print(raw['Note'])
+        getLimiter().drain(60.)
+    elif 'Error Message' in raw:
+        print(raw['Error Message'])
+    else:
+        return raw
+    return None
+
+# Open end funds such as mutual funds only price once a day, so their newest price comes from a quote:
+def isOpenEnd(symbol):
+    return len(symbol) == 5 and symbol[-1] == 'X'
+
+# Latest prices of many symbols fetched with as few requests as possible. Symbols are requested through
+# the bulk quote endpoint in groups, falling back on the newest bar of the intraday series of each symbol
+# once the bulk endpoint is found unavailable, with the intraday requests sent concurrently. A refusal of the bulk endpoint is kept in the response cache
+# so later runs skip it as well. Quotes are kept for the trading session they were fetched in, and concurrent
+# callers asking for the same symbol wait on one fetch:
+class LatestQuotes:
+    def __init__(self, bulksize=100, workers=5):
+        self.bulksize = bulksize
+        self.workers = workers
+        self.bulk = True
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    # Identify the trading session of a time as its date and whether the market has closed in New York:
+    def session(self, dt):
+        dt = dt.astimezone(BasicFinance.eastern)
+        return (dt.date(), dt.time() >= BasicFinance.closing)
+
+    # Return a dict of the newest bar of every symbol, or None for symbols without a quote:
+    def get(self, symbols):
+        now = self.session(datetime.now())
+        futures = {}; claimed = []
+        with self.lock:
+            for symbol in symbols:
+                entry = self.entries.get(symbol)
+                if entry is None or entry[0] != now:
+                    entry = self.entries[symbol] = (now, concurrent.futures.Future())
+                    claimed.append(symbol)
+                futures[symbol] = entry[1]
+
+        if claimed:
+            try:
+                fetched = self.fetch(claimed)
+            except BaseException as e:
+                with self.lock:
+                    for symbol in claimed: del self.entries[symbol]
+                for symbol in claimed: futures[symbol].set_exception(e)
+                raise
+
+            with self.lock:
+                for symbol in claimed:
+                    if fetched.get(symbol) is None: del self.entries[symbol]
+            for symbol in claimed:
+                futures[symbol].set_result(fetched.get(symbol))
+
+        return {symbol: future.result() for symbol, future in futures.items()}
+
+    def fetch(self, symbols):
+        quotes = {}
+        if self.bulkAvailable():
+            for k in range(0, len(symbols), self.bulksize):
+                quotes.update(self.fetchBulk(symbols[k:k+self.bulksize]))
+                if not self.bulk: break
+
+        # Request the remaining symbols concurrently, still waiting on the shared rate limit:
+        missing = [symbol for symbol in symbols if symbol not in quotes]
+        if len(missing) == 1:
+            quotes[missing[0]] = self.fetchIntraday(missing[0])
+        elif missing:
+            with concurrent.futures.ThreadPoolExecutor(min(self.workers, len(missing))) as pool:
+                quotes.update(zip(missing, pool.map(self.fetchIntraday, missing)))
+        return quotes
+
+    # Key of the response cache entry holding the refusal of the bulk endpoint, which does not depend on the symbols:
+    def refusalKey(self):
+        return FinanceHTTP.client.cache.key('GET', url, {'function': 'REALTIME_BULK_QUOTES'})
+
+    # Check whether the bulk endpoint may send data, which it has not if it refused this API key in this run or within a day:
+    def bulkAvailable(self):
+        cache = FinanceHTTP.client.cache
+        if self.bulk and cache is not None:
+            refusal = cache.load(self.refusalKey())
+            if refusal is not None and refusal[1] < FinanceHTTP.ttls['alphavantage-bulk']: self.bulk = False
+        return self.bulk
+
+    def fetchBulk(self, symbols):
+        resp = request({'function': 'REALTIME_BULK_QUOTES', 'symbol': ','.join(symbols), 'apikey': apikey})
+        raw = decode(resp)
+
+        # Stop trying the bulk endpoint when it does not send data, as it is a premium endpoint, and keep its
+        # notice for later runs unless the request failed or was throttled:
+        if raw is None or 'data' not in raw:
+            self.bulk = False
+            if resp is not None and resp.status_code == 200 and b'"Information"' in resp.content[:100] and FinanceHTTP.client.cache is not None:
+                FinanceHTTP.client.cache.store(self.refusalKey(), resp)
+            return {}
+
+        quotes = {}
+        for quote in raw['data']:
+            try:
+                quotes[quote['symbol']] = { 'Date':   datetime.fromisoformat(quote['timestamp']),
+                                            'Open':   float(quote['open']),
+                                            'High':   float(quote['high']),
+                                            'Low':    float(quote['low']),
+                                            'Close':  float(quote['close']),
+                                            'Volume': float(quote['volume'])                     }
+            except (KeyError, ValueError):
+                continue
+        return quotes
+
+    # Take the newest bar of the intraday series, whose ISO keys order as text, without sorting them all:
+    def fetchIntraday(self, symbol):
+        raw = decode(request({'function': 'TIME_SERIES_INTRADAY', 'symbol': symbol, 'interval': '5min', 'apikey': apikey}))
+        if raw is None or 'Time Series (5min)' not in raw or not raw['Time Series (5min)']: return None
+
+        k = max(raw['Time Series (5min)'])
+        v = raw['Time Series (5min)'][k]
+        return { 'Date':   datetime.fromisoformat(k),
+                 'Open':   float(v['1. open']),
+                 'High':   float(v['2. high']),
+                 'Low':    float(v['3. low']),
+                 'Close':  float(v['4. close']),
+                 'Volume': float(v['5. volume'])  }
+
+# Quotes shared by every instance during this run:
+quotes = LatestQuotes()
+
+# Append the latest quotes of every loaded open end fund still missing the bar of today, requesting them together:
+def appendQuotes(avs):
+    wanted = [av for av in avs if av.needsQuote()]
+    latest = quotes.get(sorted(set(av.symbol for av in wanted)))
+    for av in wanted:
+        av.appendQuote(latest[av.symbol])
+
 class AlphaVantage:
-    def __init__(self, symbol, dts = datetime.now() - timedelta(days=365), dte = datetime.now(), nl = 10, nh = 30):
+    def __init__(self, symbol, dts = datetime.now() - timedelta(days=365), dte = datetime.now(), nl = 10, nh = 30, update = True, quote = True):
         self.bf = BasicFinance.BasicFinance()
-        self.fd = FinanceDatabase.FinanceDatabase(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'finance.db'), 'AlphaVantage')
+        self.fd = FinanceDatabase.openStore(datadir, 'AlphaVantage')
 
         self.symbol = symbol
 
@@ -20,7 +216,7 @@ class AlphaVantage:
         self.nl = nl
         self.nh = nh
 
-        self.openEnd = (len(symbol) == 5 and symbol[-1] == 'X')
+        self.openEnd = isOpenEnd(symbol)
 
         # Create datetime object for the actual start time accounting for loss due to moving average:
         self.dd = (self.dte-self.dts).days
@@ -28,169 +224,263 @@ class AlphaVantage:
 
         self.head = None
         self.data = None
-
-        self.update()
-
-    def update(self):
+        self.stored = None
+        self.missing = None
+
+        if update: self.update(quote)
+
+    # Serve this window from the full history of the symbol, loading it if no other instance has, and append
+    # the latest quote unless the caller requests the quotes of many instances together with appendQuotes:
+    def update(self, quote=True):
+        future, start = self.claimSeries()
+        if start is not None:
+            loader = self.seriesLoader(start)
+            try:
+                loader.refresh()
+            except BaseException as e:
+                self.failSeries(future, e)
+                raise
+            self.publishSeries(future, loader)
+        self.useSeries(future.result())
+        if quote: appendQuotes([self])
+
+    # Load this instance's own window from the database, downloading it if anything is missing:
+    def refresh(self):
         if not self.fetchData():
-            self.downloadData()
+            self.downloadData(self.outputSize())
+
+    # Return the Future of the full history of this symbol and the date the caller has to load it from, or None
+    # if a history covering this window is loaded already. A history starting too late is replaced:
+    def claimSeries(self):
+        key = (self.symbol, function)
+        with seriesLock:
+            entry = series.get(key)
+            if entry is not None and entry[0] <= self.dtp: return entry[1], None
+            start = min(seriesStart if entry is None else entry[0], self.dtp)
+            future = concurrent.futures.Future()
+            series[key] = (start, future)
+            return future, start
+
+    # Create an instance spanning the full history of this symbol from a start date to load it with:
+    def seriesLoader(self, start):
+        loader = AlphaVantage(self.symbol, start, datetime.now(), self.nl, self.nh, update=False)
+        loader.dtp = start
+        return loader
+
+    # Forget a history so later instances load it again, unless a history reaching further back replaced it:
+    def dropSeries(self, future):
+        key = (self.symbol, function)
+        with seriesLock:
+            if key in series and series[key][1] is future: del series[key]
+
+    # Hand the loaded history to every waiting instance as arrays, dropping failures so later instances try again:
+    def publishSeries(self, future, loader):
+        if loader.data is None:
+            self.dropSeries(future)
+            future.set_result(None)
+            return
+
+        arrays = {k: np.array(v, dtype=np.float64) for k, v in loader.data.items() if k != 'Date'}
+        arrays['Date'] = np.array(loader.data['Date'], dtype='datetime64[us]')
+        future.set_result((loader.head, arrays))
+
+    def failSeries(self, future, e):
+        self.dropSeries(future)
+        future.set_exception(e)
+
+    # Slice this instance's window out of the full history into the data dict:
+    def useSeries(self, result):
+        if result is None:
+            self.data = None
+            return
+
+        self.head, arrays = result
+        lo = np.searchsorted(arrays['Date'], np.datetime64(self.dtp, 'us'), 'left')
+        hi = np.searchsorted(arrays['Date'], np.datetime64(self.dte, 'us'), 'right')
+        self.data = {'Date': arrays['Date'][lo:hi].astype(object).tolist()}
+        for k, v in arrays.items():
+            if k != 'Date': self.data[k] = v[lo:hi].tolist()
 
     def getData(self):
         return self.data
 
-    def fetchData(self):
-        # Hardcode disable reading from DB for now
-        return False
-
-        # Attempt to read in data from database:
-        stored = self.fd.fetchAll(self.symbol)
-        if stored is None: return False
-
-        # Define data structure for holding quote information:
+    # Generate dict of lists for data:
+    def newData(self):
         if function == "TIME_SERIES_DAILY_ADJUSTED":
-            data = { 'Date':     [], 'Open':     [], 'High':     [],
+            return { 'Date':     [], 'Open':     [], 'High':     [],
                      'Low':      [], 'Close':    [], 'Volume':   [],
                      'AdjClose': [], 'DivAmnt':  [], 'SplCoeff': []  }
         else:
-            data = { 'Date':     [], 'Open':     [], 'High':     [],
+            return { 'Date':     [], 'Open':     [], 'High':     [],
                      'Low':      [], 'Close':    [], 'Volume':   []  }
 
-        # Populate data structure with information from database:
-        if function == "TIME_SERIES_DAILY_ADJUSTED":
-            for d, c in zip(stored['Date'], stored['AdjClose']):
-                if d >= self.dtp and d <= self.dte:
-                    data['Date'].append(d)
-                    data['AdjClose'].append(c)
-        else:
-            for d, c in zip(stored['Date'], stored['Close']):
-                if d >= self.dtp and d <= self.dte:
-                    data['Date'].append(d)
-                    data['Close'].append(c)
+    # Read the requested window from the database into the data dict:
+    def readData(self):
+        data = self.newData()
+        names = [k for k in data if k != 'Date']
+        stored = self.fd.fetchRange(self.symbol, self.dtp, self.dte, names)
+        if stored is None: return None
 
-        # Determine expected and actual trading days:
-        acts = [d.strftime('%D') for d in data['Date']]
-        exps = [d.strftime('%D') for d in self.bf.getTradingDays(self.dtp, self.dte)]
+        data['Date'] = stored['Date'].astype(object).tolist()
+        for k in names:
+            data[k] = stored[k].tolist()
+        return data
 
-        today = datetime.today()
-        dmo = datetime(today.year, today.month, today.day,  9, 30, 00)
-        dmc = datetime(today.year, today.month, today.day, 16, 00, 00)
+    def fetchData(self):
+        # Attempt to read in data from database:
+        data = self.stored = self.readData()
+        acts = np.array([], dtype='datetime64[D]') if data is None else np.array(data['Date'], dtype='datetime64[D]')
+
+        # Determine expected trading days with a final bar and which of them are missing:
+        exps = self.bf.getTradingDays(self.dtp.date(), self.dte.date()).values.astype('datetime64[D]')
+        exps = exps[exps <= self.bf.settledDay(datetime.now())]
+        self.missing = exps[~np.isin(exps, acts)]
 
-        # If data is missing or within trading hours, download:
-        if all(elem in exps for elem in acts) or (datetime.today().strftime('%D') == exps[-1] and dmo <= today <= dmc):
+        # Ignore days without a bar older than the newest bar of the last download, which the source skipped:
+        checked = self.fd.getChecked(self.symbol)
+        if checked is not None:
+            self.missing = self.missing[self.missing >= np.datetime64(checked.date(), 'D')]
+
+        # If data is missing, download:
+        if data is None or len(self.missing) > 0:
+            return False
+        else:
+            self.head = self.storedHead(data)
             self.data = data
             return True
-        else:
-            return False
+
+    # Describe data served from the database the way receiveDaily describes a download:
+    def storedHead(self, data):
+        return { 'Info':     'Daily Prices from the database',
+                 'Symbol':   self.symbol,
+                 'Updated':  data['Date'][-1],
+                 'Output':   'Stored',
+                 'TimeZone': 'US/Eastern'                     }
+
+    # Use a compact download when every missing day is within the last 100 bars:
+    def outputSize(self):
+        if self.stored is None or len(self.missing) == 0: return 'full'
+        recent = self.bf.getTradingDays(self.missing[0].astype(object), datetime.now().date())
+        if len(recent) <= 100: return 'compact'
+        else:                  return 'full'
+
+    def dailyParams(self, outputsize):
+        return {'function': function, 'symbol': self.symbol, 'outputsize': outputsize, 'apikey': apikey}
 
     # Send values to remote webserver and download CSV reply:
-    def downloadData(self):
-        url    = 'https://www.alphavantage.co/query'
-        params = {'function': function, 'symbol': self.symbol, 'outputsize': 'full', 'apikey': apikey}
-        resp   = requests.get(url, params=params)
-
-        if resp.status_code == 200:
-            # Read in JSON from response:
-            raw  = resp.json()
-
-            if len(raw.keys()) == 1 and 'Information' in raw.keys():
-                print(raw['Information'])
-            elif len(raw.keys()) == 1 and 'Note' in raw.keys():
-                print(raw['Note'])
-            elif 'Error Message' not in raw:
-                # Define date and time formats used by AlphaVantage
-                datefmt = '%Y-%m-%d'; datelen = 10
-                timefmt = '%H:%M:%S'; timelen =  8
-
-                # Store header and parse last updated date and time:
-                head = { 'Info':     raw['Meta Data']['1. Information'],
-                         'Symbol':   raw['Meta Data']['2. Symbol'],
-                         'Updated':  raw['Meta Data']['3. Last Refreshed'],
-                         'Output':   raw['Meta Data']['4. Output Size'],
-                         'TimeZone': raw['Meta Data']['5. Time Zone']       }
-                if len(head['Updated']) == datelen:
-                    head['Updated'] = datetime.strptime(head['Updated'], datefmt)
-                elif len(head['Updated']) == datelen+timelen+1:
-                    head['Updated'] = datetime.strptime(head['Updated'], "%s %s" % (datefmt, timefmt))
-                else:
-                    head['Updated'] = datetime(1970, 1, 1)
-
-                # Generate dict of lists for data:
-                if function == "TIME_SERIES_DAILY_ADJUSTED":
-                    data = { 'Date':     [], 'Open':     [], 'High':     [],
-                             'Low':      [], 'Close':    [], 'Volume':   [],
-                             'AdjClose': [], 'DivAmnt':  [], 'SplCoeff': []  }
-                else:
-                    data = { 'Date':     [], 'Open':     [], 'High':     [],
-                             'Low':      [], 'Close':    [], 'Volume':   []  }
-
-                # Populate data structure with information in JSON response:
-                for k, v in sorted(raw['Time Series (Daily)'].items()):
-                    date = datetime.strptime(k, datefmt)
-                    if date >= self.dtp and date <= self.dte:
-                        data['Date'    ].append(      date)
-                        data['Open'    ].append(float(v['1. open']))
-                        data['High'    ].append(float(v['2. high']))
-                        data['Low'     ].append(float(v['3. low']))
-                        data['Close'   ].append(float(v['4. close']))
-                        if function == "TIME_SERIES_DAILY_ADJUSTED":
-                            data['AdjClose'].append(float(v['5. adjusted close']))
-                            data['Volume'  ].append(  int(v['6. volume']))
-                            data['DivAmnt' ].append(float(v['7. dividend amount']))
-                            data['SplCoeff'].append(float(v['8. split coefficient']))
-                        else:
-                            data['Volume'  ].append(  int(v['5. volume']))
-
-                # Check most recent data for open end funds (such as mutual funds)
-                if self.openEnd:
-                    params = {'function': 'TIME_SERIES_INTRADAY', 'symbol': self.symbol, 'interval': '5min', 'apikey': apikey}
-                    resp   = requests.get(url, params=params)
-
-                    if resp.status_code == 200:
-                        # Read in JSON from response:
-                        raw  = resp.json()
-
-                        if len(raw.keys()) == 1 and 'Information' in raw.keys():
-                            print(raw['Information'])
-                        elif len(raw.keys()) == 1 and 'Note' in raw.keys():
-                            print(raw['Note'])
-                        elif 'Error Message' not in raw:
-                            # Store header and parse last updated date and time:
-                            head = { 'Info':     raw['Meta Data']['1. Information'],
-                                     'Symbol':   raw['Meta Data']['2. Symbol'],
-                                     'Updated':  raw['Meta Data']['3. Last Refreshed'],
-                                     'Output':   raw['Meta Data']['5. Output Size'],
-                                     'TimeZone': raw['Meta Data']['6. Time Zone']       }
-                            if len(head['Updated']) == datelen:
-                                head['Updated'] = datetime.strptime(head['Updated'], datefmt)
-                            elif len(head['Updated']) == datelen+timelen+1:
-                                head['Updated'] = datetime.strptime(head['Updated'], "%s %s" % (datefmt, timefmt))
-                            else:
-                                head['Updated'] = datetime(1970, 1, 1)
-                                print("invalid")
-
-                            k, v = sorted(raw['Time Series (5min)'].items())[-1]
-                            date = datetime.strptime(k, "%s %s" % (datefmt, timefmt))
-                            data['Date'    ].append(      date)
-                            data['Open'    ].append(float(v['1. open']))
-                            data['High'    ].append(float(v['2. high']))
-                            data['Low'     ].append(float(v['3. low']))
-                            data['Close'   ].append(float(v['4. close']))
-                            data['AdjClose'].append(float(v['5. adjusted close']))
-                            data['Volume'  ].append(  int(v['6. volume']))
-                            data['DivAmnt' ].append(float(v['7. dividend amount']))
-                            data['SplCoeff'].append(float(v['8. split coefficient']))
-
-                # Store this data in the object:
-                self.head = head
-                self.data = data
-
-                # Insert information into database:
-                if function == "TIME_SERIES_DAILY_ADJUSTED":
-                    self.fd.insertAll(self.symbol, self.data['Date'], self.data['AdjClose'])
-                else:
-                    self.fd.insertAll(self.symbol, self.data['Date'], self.data['Close'])
-            else: self.data = None
-        else: self.data = None
+    def downloadData(self, outputsize='full'):
+        self.receiveDaily(request(self.dailyParams(outputsize)), outputsize)
+
+    # Convert a daily time series to the data dict in date order, sorting the ISO date keys before
+    # any bar is touched and converting all numeric fields with one array conversion:
+    def parseSeries(self, series, fields):
+        keys = np.sort(np.array(list(series.keys())))
+
+        values = np.array([[series[k][field] for key, field in fields] for k in keys], dtype=str).reshape(len(keys), len(fields)).astype(np.float64)
+
+        data = {'Date': keys.astype('datetime64[D]').astype('datetime64[us]').astype(object).tolist()}
+        for j, (key, field) in enumerate(fields):
+            if key == 'Volume': data[key] = values[:, j].astype(np.int64).tolist()
+            else:               data[key] = values[:, j].tolist()
+        return data
+
+    # Parse a daily time series response, store it in the database and keep the requested window:
+    def receiveDaily(self, resp, outputsize):
+        self.data = None
+        if resp is None or resp.status_code != 200: return
+
+        # Read in JSON from response:
+        raw  = loads(resp.content)
+
+        if len(raw.keys()) == 1 and 'Information' in raw.keys():
+            print(raw['Information'])
+        elif len(raw.keys()) == 1 and 'Note' in raw.keys():
+            print(raw['Note'])
+            getLimiter().drain(60.)
+        elif 'Error Message' not in raw:
+            # Define date and time formats used by AlphaVantage
+            datefmt = '%Y-%m-%d'; datelen = 10
+            timefmt = '%H:%M:%S'; timelen =  8
+
+            # Store header and parse last updated date and time:
+            head = { 'Info':     raw['Meta Data']['1. Information'],
+                     'Symbol':   raw['Meta Data']['2. Symbol'],
+                     'Updated':  raw['Meta Data']['3. Last Refreshed'],
+                     'Output':   raw['Meta Data']['4. Output Size'],
+                     'TimeZone': raw['Meta Data']['5. Time Zone']       }
+            if len(head['Updated']) == datelen:
+                head['Updated'] = datetime.strptime(head['Updated'], datefmt)
+            elif len(head['Updated']) == datelen+timelen+1:
+                head['Updated'] = datetime.strptime(head['Updated'], "%s %s" % (datefmt, timefmt))
+            else:
+                head['Updated'] = datetime(1970, 1, 1)
+
+            # Convert every bar of the response to the data dict in bulk:
+            bars = self.parseSeries(raw['Time Series (Daily)'], dailyFields[function])
+
+            # Insert every daily bar into the database and note the newest one in one transaction, so days
+            # the source skipped before it are not requested again while later days still are:
+            with self.fd.transaction():
+                self.fd.upsertBars(self.symbol, bars)
+                if bars['Date']: self.fd.setChecked(self.symbol, bars['Date'][-1])
+
+            # A compact download only holds recent bars, so read the whole window back:
+            if outputsize == 'compact':
+                data = self.readData()
+            else:
+                data = self.windowData(bars)
+
+            # Store this data in the object:
+            self.head = head
+            self.data = data
+
+    # Keep the bars of a data dict within the requested window:
+    def windowData(self, data):
+        dates = np.array(data['Date'], dtype='datetime64[us]')
+        lo = np.searchsorted(dates, np.datetime64(self.dtp, 'us'), 'left')
+        hi = np.searchsorted(dates, np.datetime64(self.dte, 'us'), 'right')
+        return {k: v[lo:hi] for k, v in data.items()}
+
+    # Check whether this is an open end fund (such as a mutual fund) whose data lacks the bar of a trading day
+    # in session today, so that its latest quote would be appended rather than thrown away:
+    def needsQuote(self):
+        if not self.openEnd or not self.data or not self.data['Date']: return False
+        today = datetime.now(BasicFinance.eastern).date()
+        return self.data['Date'][-1].date() < today and len(self.bf.getTradingDays(today, today)) > 0
+
+    # Append the latest quote to the daily data when it is newer than the last daily bar:
+    def appendQuote(self, quote):
+        if quote is None: return
+        if self.data['Date'] and quote['Date'].date() <= self.data['Date'][-1].date(): return
+
+        for k in self.data:
+            if k in quote:         self.data[k].append(quote[k])
+            elif k == 'AdjClose':  self.data[k].append(quote['Close'])
+            elif k == 'DivAmnt':   self.data[k].append(0.0)
+            elif k == 'SplCoeff':  self.data[k].append(1.0)
+
+    # Serve this window from the full history of the symbol like update, loading it without blocking the event loop:
+    async def updateAsync(self, quote=True):
+        future, start = self.claimSeries()
+        if start is not None:
+            loader = self.seriesLoader(start)
+            try:
+                await loader.refreshAsync()
+            except BaseException as e:
+                self.failSeries(future, e)
+                raise
+            self.publishSeries(future, loader)
+        self.useSeries(await asyncio.wrap_future(future))
+        if quote: await asyncio.to_thread(appendQuotes, [self])
+        return self
+
+    # Load or download one symbol with every request running in a worker thread, so parsing overlaps the
+    # network waits of other symbols:
+    async def refreshAsync(self):
+        if not await asyncio.to_thread(self.fetchData):
+            outputsize = self.outputSize()
+            daily = await asyncio.to_thread(request, self.dailyParams(outputsize))
+            await asyncio.to_thread(self.receiveDaily, daily, outputsize)
 
     def printLatestCrossover(self, fund, crossovers):
         print(fund + ' fund latest crossover:')
@@ -209,26 +499,70 @@ class AlphaVantage:
             sys.stdout.write('  None within ' + str(self.dd) + ' days!')
             return False
 
+# Load or download every symbol concurrently, reporting symbols that fail without stopping the others. Once
+# the daily data of every symbol is known, the quotes of the open end funds still lacking today are requested together:
+def downloadAll(symbols):
+    async def run(avs):
+        return await asyncio.gather(*[av.updateAsync(quote=False) for av in avs], return_exceptions=True)
+
+    avs = {}
+    for smb, result in zip(symbols, asyncio.run(run([AlphaVantage(smb, update=False) for smb in symbols]))):
+        if isinstance(result, Exception):
+            print("Could not retrieve data for %s: %s" % (smb, result))
+        else:
+            avs[smb] = result
+    appendQuotes(avs.values())
+    return avs
+
 if __name__ == "__main__":
 
-    if len(sys.argv) < 2:
-        symbols = ['SWTSX', 'SWISX']
-    else:
-        symbols = sys.argv[1:]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("symbols", help="symbols to load", nargs='*', default=['SWTSX', 'SWISX'])
+    parser.add_argument("--batch", help="summarize all symbols from one batch computation instead of plotting each symbol", action='store_true')
+    parser.add_argument("--async", help="download all symbols concurrently", dest='concurrent', action='store_true')
+    parser.add_argument("--url", help="query endpoint, such as a local server replaying recorded responses", default=None)
+    parser.add_argument("--offline", help="serve every request from the response cache", action='store_true')
+    parser.add_argument("--memmap", help="keep prices in the memory-mapped store instead of finance.db", action='store_true')
+    args = parser.parse_args()
 
-    symbols = [s.upper() for s in symbols]
+    if args.url is not None: url = args.url
+    if args.offline: FinanceHTTP.client.offline = True
+    if args.memmap: FinanceDatabase.backend = 'memmap'
+
+    symbols = [s.upper() for s in args.symbols]
 
     # Define image path in same directory as this script:
     imgpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'images', 'av')
 
-    for smb in symbols:
-        av = AlphaVantage(smb)
-        data = av.getData()
+    # Load every symbol, either concurrently or one after another, then request the quotes of the open end funds needing them together:
+    if args.concurrent:
+        avs = downloadAll(symbols)
+    else:
+        avs = {smb: AlphaVantage(smb, quote=False) for smb in symbols}
+        appendQuotes(avs.values())
 
-        # If data cannot be retreived, exit the program with an error:
-        if data is None:
+    # If data cannot be retreived, skip the symbol with an error:
+    for smb in symbols:
+        if smb in avs and avs[smb].getData() is None:
             print("Could not retrieve data from remote server for %s." % smb)
-            continue
+            del avs[smb]
+
+    if args.batch:
+        if not avs: sys.exit(1)
+
+        # Align every symbol onto shared dates and compute signals for all of them in one pass:
+        if function == "TIME_SERIES_DAILY_ADJUSTED": key = 'AdjClose'
+        else:                                        key = 'Close'
+        av = list(avs.values())[0]
+        dates, prices = av.bf.alignSeries([a.getData()['Date'] for a in avs.values()], [a.getData()[key] for a in avs.values()])
+        results = av.bf.batchSignals(dates, prices, av.nl, av.nh, av.dd, 'EWMA', [a.openEnd for a in avs.values()], list(avs))
+
+        fp = FinancePlot.FinancePlot('AlphaVantage', av.dd, imgpath)
+        fp.printBatchSignals(results)
+        sys.exit()
+
+    for smb, av in avs.items():
+        data = av.getData()
 
         # Plot all AlphaVantage symbols:
         fp = FinancePlot.FinancePlot('AlphaVantage', av.dd, imgpath)
@@ -0,0 +1,116 @@
+import os, sys, glob, json, time, argparse, tempfile, threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Replay recorded AlphaVantage responses from a directory of <FUNCTION>-<SYMBOL>.json files, so downloads
+# can be exercised without network access or API budget. Point AlphaVantage.py at it with --url or by
+# setting ALPHAVANTAGE_URL to http://<host>:<port>/query:
+class StubHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_GET(self):
+		query = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+		filename = os.path.join(self.server.datadir, "%s-%s.json" % (query.get('function', ''), query.get('symbol', '').upper()))
+
+		if os.path.isfile(filename):
+			with open(filename, 'rb') as fh:
+				body = fh.read()
+		else:
+			body = json.dumps({'Error Message': "No recorded response for %s" % os.path.basename(filename)}).encode()
+
+		# Simulate the round trip time of the real service:
+		time.sleep(self.server.delay)
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		if self.server.verbose: BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def serve(datadir, host='127.0.0.1', port=8765, delay=0., verbose=False):
+	server = ThreadingHTTPServer((host, port), StubHandler)
+	server.datadir = datadir
+	server.delay = delay
+	server.verbose = verbose
+	return server
+
+# Download every recorded daily series concurrently through AlphaVantage.py against a stub serving the recorded
+# responses, with a scratch database and no response cache, and return a list of differences from the recordings:
+def check(datadir):
+	import AlphaVantage, FinanceDatabase, FinanceHTTP
+
+	server = serve(datadir, port=0)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	scratch = tempfile.TemporaryDirectory()
+	AlphaVantage.url = 'http://127.0.0.1:%d/query' % server.server_port
+	AlphaVantage.datadir = scratch.name
+	FinanceHTTP.client.cache = None
+
+	problems = []
+	try:
+		recorded = {}
+		for filename in sorted(glob.glob(os.path.join(datadir, AlphaVantage.function + '-*.json'))):
+			with open(filename) as fh:
+				recorded[os.path.basename(filename)[len(AlphaVantage.function)+1:-5]] = json.load(fh)['Time Series (Daily)']
+
+		avs = AlphaVantage.downloadAll(list(recorded))
+		fd = FinanceDatabase.FinanceDatabase(os.path.join(scratch.name, 'finance.db'), 'AlphaVantage')
+		fields = AlphaVantage.dailyFields[AlphaVantage.function]
+		for symbol, series in recorded.items():
+			if symbol not in avs:
+				problems.append("%s was not downloaded" % symbol)
+				continue
+
+			# Every recorded bar must be stored with the recorded values, and the newest one noted as checked:
+			days = sorted(series)
+			stored = fd.fetchRange(symbol, names=[key for key, field in fields])
+			if stored is None or len(stored['Date']) != len(days):
+				problems.append("%s stored %d of %d bars" % (symbol, 0 if stored is None else len(stored['Date']), len(days)))
+				continue
+			if not np.array_equal(stored['Date'].astype('datetime64[D]'), np.array(days, dtype='datetime64[D]')):
+				problems.append("%s stored other dates than recorded" % symbol)
+			for key, field in fields:
+				if not np.allclose(stored[key], [float(series[day][field]) for day in days]):
+					problems.append("%s stored other %s values than recorded" % (symbol, key))
+			checked = fd.getChecked(symbol)
+			if checked is None or checked.date().isoformat() != days[-1]:
+				problems.append("%s checked %s instead of %s" % (symbol, checked, days[-1]))
+	finally:
+		FinanceDatabase.connections.closeAll()
+		server.shutdown()
+		server.server_close()
+		scratch.cleanup()
+
+	return problems
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("datadir", help="directory of recorded <FUNCTION>-<SYMBOL>.json responses")
+	parser.add_argument("-p", "--port", help="port to listen on", type=int, default=8765)
+	parser.add_argument("-d", "--delay", help="seconds to wait before every response", type=float, default=0.)
+	parser.add_argument("-v", "--verbose", help="log every request", action='store_true')
+	parser.add_argument("-c", "--check", help="download the recorded symbols through AlphaVantage.py and compare the stored rows", action='store_true')
+	args = parser.parse_args()
+
+	if not os.path.isdir(args.datadir):
+		print("Recorded response directory %s not found." % args.datadir)
+		sys.exit(1)
+
+	if args.check:
+		problems = check(args.datadir)
+		for problem in problems:
+			print(problem)
+		print("%s: %d problems" % ('FAILED' if problems else 'OK', len(problems)))
+		sys.exit(1 if problems else 0)
+
+	server = serve(args.datadir, port=args.port, delay=args.delay, verbose=args.verbose)
+	print("Replaying %s on http://127.0.0.1:%d/query" % (args.datadir, server.server_port))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		server.server_close()
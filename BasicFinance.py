@@ -1,11 +1,22 @@
-import pytz, sys
+import pytz, sys, os, collections, tempfile
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time
 from matplotlib.dates import num2date, date2num
 import pandas as pd
 from pandas.tseries.offsets import CustomBusinessDay
 from pandas.tseries.holiday import AbstractHolidayCalendar, USFederalHolidayCalendar, Holiday, nearest_workday, USMartinLutherKingJr, USPresidentsDay, GoodFriday, USMemorialDay, USLaborDay, USThanksgivingDay
 
+# Daily prices become final when the markets close in New York:
+eastern = pytz.timezone('America/New_York')
+closing = time(16)
+
+# Structured array layout for crossover signals:
+crossoverType = np.dtype([('buy', np.bool_), ('t', np.float64), ('p', np.float64)])
+
+# Structured array layout for backtest trades:
+tradeType = np.dtype([('buy', np.bool_), ('signal', np.float64), ('t', np.float64), ('p', np.float64), ('index', np.int64),
+                      ('price', np.float64), ('executed', np.bool_), ('position', np.float64), ('gain', np.float64)])
+
 class USTradingCalendar(AbstractHolidayCalendar):
 	rules = [
 		Holiday('NewYearsDay', month=1, day=1, observance=nearest_workday),
@@ -23,23 +34,104 @@ class TSPTradingCalendar(AbstractHolidayCalendar):
 	rules = USFederalHolidayCalendar().rules
 	rules.append(GoodFriday)
 
+# Trading days for a holiday calendar materialized once as a sorted datetime64 array:
+class TradingDayIndex:
+	def __init__(self, calendar, start=datetime(1990, 1, 1), end=None, cachedir=None):
+		self.calendar = calendar
+
+		# Cover through the end of the year five years from now unless told otherwise:
+		if end is None: end = datetime(datetime.now().year + 5, 12, 31)
+		if cachedir is None: cachedir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache')
+
+		self.start = np.datetime64(pd.Timestamp(start).date(), 'D')
+		self.end = np.datetime64(pd.Timestamp(end).date(), 'D')
+		self.cachedir = cachedir
+
+		self.days = self.load()
+
+	# Read the materialized days from disk, generating and saving them if not yet cached:
+	def load(self):
+		filename = os.path.join(self.cachedir, "calendar-%s-%s-%s.npy" % (type(self.calendar).__name__, self.start, self.end))
+		if os.path.isfile(filename):
+			return np.load(filename)
+
+		days = pd.date_range(start=str(self.start), end=str(self.end), freq=CustomBusinessDay(calendar=self.calendar)).values.astype('datetime64[D]')
+
+		# Write to a temporary file and rename so concurrent readers never see a partial file:
+		os.makedirs(self.cachedir, exist_ok=True)
+		fd, tmpname = tempfile.mkstemp(suffix='.npy', dir=self.cachedir)
+		with os.fdopen(fd, 'wb') as fh:
+			np.save(fh, days)
+		os.replace(tmpname, filename)
+
+		return days
+
+	# Convert a date, datetime, or timestamp into a timezone naive pandas timestamp:
+	def _timestamp(self, dt):
+		ts = pd.Timestamp(dt)
+		if ts.tzinfo is not None: ts = ts.tz_localize(None)
+		return ts
+
+	def isTradingDay(self, dt):
+		day = np.datetime64(self._timestamp(dt).date(), 'D')
+		if day < self.start or day > self.end:
+			return CustomBusinessDay(calendar=self.calendar).is_on_offset(pd.Timestamp(day))
+		i = np.searchsorted(self.days, day)
+		return i < len(self.days) and self.days[i] == day
+
+	# Return the date of the first trading day after the given date:
+	def nextTradingDay(self, dts):
+		day = np.datetime64(self._timestamp(dts).date(), 'D')
+		i = np.searchsorted(self.days, day, side='right')
+		if day < self.start or i >= len(self.days):
+			inst = CustomBusinessDay(calendar=self.calendar)
+			return (pd.date_range(start=day + 1, end=day + 8, freq=inst).tolist()[0]).date()
+		return self.days[i].astype(object)
+
+	# Return trading days in the same form as pd.date_range with a CustomBusinessDay frequency:
+	def tradingDaysBetween(self, dts, dte):
+		s = self._timestamp(dts)
+		e = self._timestamp(dte)
+		if s.normalize() < pd.Timestamp(self.start) or e > pd.Timestamp(self.end):
+			return pd.date_range(start=dts, end=dte, freq=CustomBusinessDay(calendar=self.calendar))
+
+		# Each day carries the time of day of the start and must not pass the end:
+		tod = s - s.normalize()
+		lo = np.searchsorted(self.days, np.datetime64(s.date(), 'D'), side='left')
+		hi = np.searchsorted(self.days, np.datetime64((e - tod).floor('D').date(), 'D'), side='right')
+		return pd.DatetimeIndex(self.days[lo:hi].astype('datetime64[us]') + tod.to_timedelta64())
+
+# Trading day indices shared by every BasicFinance instance in this process:
+_tradingDayIndices = {}
+
 class BasicFinance:
 	def __init__(self):
 		pd.plotting.register_matplotlib_converters()
 
+	# Return the shared trading day index for a holiday calendar, building it on first use:
+	def getTradingDayIndex(self, calendar):
+		name = calendar.__name__
+		if name not in _tradingDayIndices:
+			_tradingDayIndices[name] = TradingDayIndex(calendar())
+		return _tradingDayIndices[name]
+
 	def getFederalTradingDays(self, dts, dte):
-		inst = CustomBusinessDay(calendar=TSPTradingCalendar())
-		return pd.date_range(start=dts, end=dte, freq=inst)
+		return self.getTradingDayIndex(TSPTradingCalendar).tradingDaysBetween(dts, dte)
 
 	def getNextFederalTradingDay(self, dts):
-		return (self.getFederalTradingDays(dts.date()+timedelta(days=1), (dts+timedelta(days=7)).date()).tolist()[0]).date()
+		return self.getTradingDayIndex(TSPTradingCalendar).nextTradingDay(dts)
 
 	def getTradingDays(self, dts, dte):
-		inst = CustomBusinessDay(calendar=USTradingCalendar())
-		return pd.date_range(start=dts, end=dte, freq=inst)
+		return self.getTradingDayIndex(USTradingCalendar).tradingDaysBetween(dts, dte)
 
 	def getNextTradingDay(self, dts):
-		return (self.getTradingDays(dts.date()+timedelta(days=1), (dts+timedelta(days=7)).date()).tolist()[0]).date()
+		return self.getTradingDayIndex(USTradingCalendar).nextTradingDay(dts)
+
+	# Return the last date whose daily price is final as of the given time, taking naive times as local time:
+	def settledDay(self, dt):
+		dt = dt.astimezone(eastern)
+		if dt.time() >= closing: return np.datetime64(dt.date(), 'D')
+		else:                    return np.datetime64(dt.date(), 'D') - 1
 
 	def formatDate(self, dt):
 		return dt.strftime("%Y/%m/%d")
@@ -52,119 +144,449 @@ class BasicFinance:
 
 	# Define a simple moving average that replaces invalid positions with NaN:
 	def SMA(self, l, n):
-		# Start with empty list and fill invalid values first:
-		ma = [np.nan]*n
-		# Move through the valid positions in list and compute moving average:
-		for i in range(n, len(l)):
-			ma.append(np.mean(l[i-n:i]))
-		# Return result
-		return ma
-
-	# Define an exponential weighted moving average:
-	def EWMA(self, data, window):
-		if type(data) == list:
-			data = np.array(data)
+		return self.movingAverages(l, [n])[n]
+
+	# Compute simple moving averages for several windows in one pass over running sums. The sums restart
+	# at every block of at least the longest window, so a window spans at most two blocks and trending
+	# prices do not lose precision to the magnitude of the whole series:
+	def movingAverages(self, l, windows, blocksize=1024):
+		data = np.asarray(l, dtype=np.float64)
+		valid = np.isfinite(data)
+		size = data.shape[0]
+		rest = data.shape[1:]
+
+		# Running sums within each block and of invalid counts overall, each with a leading zero:
+		width = max([blocksize] + list(windows))
+		count = max(-(-size // width), 1)
+		blocks = np.zeros((count*width,) + rest)
+		blocks[:size] = np.where(valid, data, 0.)
+		blocks = blocks.reshape((count, width) + rest)
+		sums = np.concatenate((np.zeros((count, 1) + rest), np.cumsum(blocks, axis=1)), axis=1)
+		bads = np.concatenate((np.zeros((1,) + rest, dtype=np.int64), np.cumsum(~valid, axis=0)))
+
+		mas = {}
+		for n in windows:
+			# Start with NaN and fill valid positions with the mean of the previous n values:
+			ma = np.full((max(n, size),) + rest, np.nan)
+			if n < size:
+				# Window [s, e) starts at offset os of block bs and ends at offset oe of block be:
+				s = np.arange(0, size - n)
+				e = s + n
+				bs, os_ = np.divmod(s, width)
+				be = (e - 1) // width
+				oe = e - be*width
+				total = sums[be, oe] - sums[bs, os_] + np.where((be != bs).reshape((-1,) + (1,)*len(rest)), sums[bs, width], 0.)
+				ma[n:size] = np.where(bads[n:-1] - bads[:-n-1] > 0, np.nan, total / n)
+			mas[n] = ma
+
+		# Return result keyed by window
+		return mas
+
+	# Compute moving averages of one series for several windows as columns of a matrix:
+	def movingAverageMatrix(self, p, windows, avgtype='SMA'):
+		if avgtype == 'EWMA':
+			return self.EWMA(np.repeat(np.asarray(p, dtype=np.float64)[:, None], len(windows), axis=1), np.asarray(windows))
+		mas = self.movingAverages(p, windows)
+		return np.stack([mas[n] for n in windows], axis=1)
+
+	# Define an exponential weighted moving average that skips NaN gaps, where window
+	# may also be an array giving a separate window for each column of data:
+	def EWMA(self, data, window, adjust=False, chunk=256):
+		data = np.asarray(data, dtype=np.float64)
+		if data.shape[0] == 0: return data.copy()
 
 		alpha = 2 / (window + 1.)
-		alpha_rev = 1 - alpha
+		alpha_rev = np.asarray(1 - alpha)
+
+		# Limit block length so the decay across one block stays well within float range, leaving out windows of
+		# one day, which decay completely at every value and are filled in below:
+		identity = alpha_rev == 0
+		if np.any(~identity):
+			chunk = int(max(1, min(chunk, np.min(-100 / np.log10(alpha_rev[~identity])))))
+
+		# Missing values hold the previous state instead of decaying it:
+		valid = np.isfinite(data)
+		decay = np.where(valid, alpha_rev, 1.)
+		value = np.where(valid, data, 0.)
+
+		with np.errstate(invalid='ignore', divide='ignore'):
+			if adjust:
+				# Normalize the weighted sum by the sum of the weights seen so far:
+				zero = np.zeros(data.shape[1:])
+				ma = self._decayRecursion(decay, value, zero, chunk) / self._decayRecursion(decay, valid.astype(np.float64), zero, chunk)
+			else:
+				# Seed the state with the first valid value so the first average equals it:
+				first = np.expand_dims(np.argmax(valid, axis=0), 0)
+				ma = self._decayRecursion(decay, alpha * value, np.take_along_axis(value, first, axis=0)[0], chunk)
 
-		scale = 1 / alpha_rev
-		n = data.shape[0]
+		# The average over a window of one day is the latest valid value:
+		if np.any(identity):
+			latest = np.where(valid, np.arange(data.shape[0]).reshape((-1,) + (1,)*(data.ndim-1)), 0)
+			ma = np.where(identity, np.take_along_axis(data, np.maximum.accumulate(latest, axis=0), axis=0), ma)
 
-		r = np.arange(n)
-		scale_arr = scale ** r
-		offset = data[0] * alpha_rev ** (r + 1)
-		pw0 = alpha * alpha_rev ** (n - 1)
+		# Positions before the first valid value have no average:
+		ma[np.cumsum(valid, axis=0) == 0] = np.nan
 
-		mult = data * pw0 * scale_arr
-		cumsums = mult.cumsum()
+		return ma
 
-		return offset + cumsums * scale_arr[::-1]
+	# Evaluate y[i] = a[i]*y[i-1] + b[i] along the first axis one block at a time:
+	def _decayRecursion(self, a, b, y0, chunk):
+		y = np.empty(b.shape)
+		for s in range(0, b.shape[0], chunk):
+			# Within a block, y[i] = A[i]*(y0 + sum(b[k]/A[k])) with A the running decay product:
+			A = np.cumprod(a[s:s+chunk], axis=0)
+			y[s:s+chunk] = A * (y0 + np.cumsum(b[s:s+chunk] / A, axis=0))
+			# Carry the last state of this block into the next one:
+			y0 = y[min(s+chunk, b.shape[0])-1]
+		return y
+
+	# Return the index of the first date to keep when trimming a series to its last dd days:
+	def getCutIndex(self, dates, dd):
+		cut = np.searchsorted(dates, date2num(num2date(dates[-1]) - timedelta(days=dd-1)), side='right')
+		if cut == len(dates): return 0
+		return max(cut - 1, 0)
 
 	# Detect buy and sell crossovers of two averaged lists and return signals:
 	def detectCrossovers(self, dates, manl, manh, dd):
-		# Create empty data structure:
-		crossovers = []
+		# If short term average is below long term average, signal to buy (True), otherwise to sell (False):
+		return [(bool(c['buy']), (c['t'], c['p'])) for c in self.detectCrossoverArray(dates, manl, manh, dd)]
+
+	# Detect crossovers of two averaged arrays and return a structured array of signals:
+	def detectCrossoverArray(self, dates, manl, manh, dd):
+		dates = np.asarray(dates, dtype=np.float64)
+		manl = np.asarray(manl, dtype=np.float64)
+		manh = np.asarray(manh, dtype=np.float64)
+
+		# Detect change in sign at every point in the difference of two source lists,
+		# skipping points where the averages are equal since they are not a signal:
+		i = np.nonzero(np.diff(np.sign(manl - manh)))[0]
+		i = i[manl[i] != manh[i]]
+
+		with np.errstate(invalid='ignore', divide='ignore'):
+			# Compute slopes for both short term and long term averages:
+			manlm = (manl[i+1] - manl[i]) / (dates[i+1] - dates[i])
+			manhm = (manh[i+1] - manh[i]) / (dates[i+1] - dates[i])
+
+			# Compute exact time and value of every crossover:
+			t = (manh[i] - manl[i]) / (manlm - manhm) + dates[i]
+			p = manlm * (t - dates[i]) + manl[i]
+
+		# Keep only crossovers within the last dd days:
+		keep = t > date2num(num2date(dates[-1]) - timedelta(days=dd+1)) if len(dates) else np.zeros(0, dtype=bool)
+
+		crossovers = np.empty(np.count_nonzero(keep), dtype=crossoverType)
+		crossovers['buy'] = manl[i[keep]] < manh[i[keep]]
+		crossovers['t'] = t[keep]
+		crossovers['p'] = p[keep]
+		return crossovers
 
-		# Detect change in sign at every point in the difference of two source lists:
-		for i in np.where(np.diff(np.sign((manl-manh))))[0].reshape(-1):
-			# If prices are the same, not a signal
-			if manl[i] == manh[i]: continue
+	# Convert a list of (bool, (t, p)) signals into a structured crossover array:
+	def crossoverArray(self, crossovers):
+		if isinstance(crossovers, np.ndarray): return crossovers
+		return np.array([(s, t, p) for s, (t, p) in crossovers], dtype=crossoverType)
+
+	# Find the first index where ceil(t - ts) is at least c for every signal time ts:
+	def _firstCeilAtLeast(self, t, ts, c):
+		i = np.searchsorted(t, ts + c - 1, side='right')
+		# Step over points where rounding in ts + c - 1 disagrees with the ceiling:
+		i -= (i > 0) & (np.ceil(t[np.maximum(i-1, 0)] - ts) >= c)
+		i += (i < len(t)) & (np.ceil(t[np.minimum(i, len(t)-1)] - ts) < c)
+		return i
+
+	# Backtest following signals, returning the gain, settled signals, and per-trade records:
+	def backtest(self, t, p, crossovers, openend=True):
+		t = np.asarray(t, dtype=np.float64)
+		p = np.asarray(p, dtype=np.float64)
+		crossovers = self.crossoverArray(crossovers)
+		n = len(t)
 
-			# Compute slopes for both short term and long term SMA:
-			manlm = (manl[i+1]-manl[i])/(dates[i+1]-dates[i])
-			manhm = (manh[i+1]-manh[i])/(dates[i+1]-dates[i])
+		if openend: tradedelay = 1
+		else:       tradedelay = 0
 
-			# Compute exact time and value of the crossover:
-			t = (manh[i]-manl[i])/(manlm-manhm)+dates[i]
-			p = manlm*(t-dates[i])+manl[i]
+		# Map every signal to the first date nearest it in whole days, matching argmin(abs(ceil(t - ts))):
+		ts = crossovers['t']
+		k = self._firstCeilAtLeast(t, ts, 0)
+		after = np.ceil(t[np.minimum(k, n-1)] - ts)
+		before = np.ceil(t[np.maximum(k-1, 0)] - ts)
+		useBefore = (k > 0) & ((k == n) | (-before <= after))
+		nearest = np.where(useBefore, self._firstCeilAtLeast(t, ts, np.where(useBefore, before, 0)), k)
+
+		# Settle each signal after the trade delay, dropping signals that settle past the end:
+		i = nearest + 1 + tradedelay
+		settled = i < n - tradedelay
+		i = i[settled]
+
+		crossadjust = np.empty(len(i), dtype=crossoverType)
+		crossadjust['buy'] = crossovers['buy'][settled]
+		crossadjust['t'] = t[i]
+		crossadjust['p'] = p[i]
+
+		# The first signal trades at its settle price and is ignored if it is a buy, while
+		# later signals trade at the price of the last date before they settle:
+		j = np.searchsorted(t, t[np.searchsorted(t, t[i], side='left') - 1], side='left')
+		if len(i): j[0] = i[0]
+		executed = np.ones(len(i), dtype=bool)
+		if len(i): executed[0] = not crossadjust['buy'][0]
+
+		# Buy share on first day of period no matter what, then follow the signals:
+		trades = np.empty(len(i) + 2, dtype=tradeType)
+		trades[0] = (True, np.nan, t[0], p[0], 0, p[0], True, 0., 0.)
+		trades['buy'][1:-1] = crossadjust['buy']
+		trades['signal'][1:-1] = crossovers['t'][settled]
+		trades['t'][1:-1] = crossadjust['t']
+		trades['p'][1:-1] = crossadjust['p']
+		trades['index'][1:-1] = j
+		trades['price'][1:-1] = p[j]
+		trades['executed'][1:-1] = executed
 
-			# Append the crossover value to the data structure:
-			if t > date2num(num2date(dates[len(dates)-1])-timedelta(days=dd+1)):
-				# If short term SMA is below long term SMA, signal
-				# to buy (True), otherwise signal to sell (False):
-				crossovers.append((manl[i] < manh[i], (t, p)))
+		# If signals are over and share hasn't been sold yet, sell share on end date:
+		sells = np.nonzero(trades['executed'][:-1] & ~trades['buy'][:-1])[0]
+		buys = np.nonzero(trades['executed'][:-1] & trades['buy'][:-1])[0]
+		closing = len(sells) == 0 or trades['t'][buys[-1]] > trades['t'][sells[-1]]
+		trades[-1] = (False, np.nan, t[-1], p[-1], n-1, p[-1], closing, 0., 0.)
 
-		# Return the completed data structure
-		return crossovers
+		# Track the running position and cash flow of the executed trades:
+		flow = np.where(trades['executed'], np.where(trades['buy'], -trades['price'], trades['price']), 0.)
+		trades['gain'] = np.cumsum(flow)
+		held = np.maximum.accumulate(np.where(trades['executed'], np.arange(len(trades)), 0))
+		trades['position'] = trades['buy'][held]
+		if not closing: trades = trades[:-1]
+
+		return trades['gain'][-1], crossadjust, trades
 
 	# Calculate PIP following signals:
 	def calcPIPFS(self, t, p, crossovers, verbose=False, openend=True):
-
-		crossadjust = []
 		if openend: tradedelay = 1
 		else:       tradedelay = 0
 
 		print("  (assumes %d day trade delay)" % tradedelay)
 
-		for s, (ts, ps) in crossovers:
-			i = np.argmin(abs(np.ceil(t - ts))) + 1 + tradedelay
-			if i < len(t) - tradedelay:
-				crossadjust.append((s, (t[i], p[i])))
-
-		bl = None
-		sl = None
-
-		if verbose: print()
-
-		# Buy share on first day of period no matter what:
-		if verbose: print('share bought on ' + num2date(t[0]).strftime('%m/%d/%y') + ' for $' + '{0:.2f}'.format(p[0]))
-		bl = (t[0], p[0])
-
-		gain = -p[0]
-		for i, (s, (ts, ps)) in enumerate(crossadjust):
-			# If first signal is buy, ignore, otherwise sell:
-			if i == 0:
-				if s:
-					if verbose: sys.stdout.write('buy signal ignored')
-				else:
-					if verbose: sys.stdout.write('share sold')
-					sl = (ts, ps)
-					gain += ps
-			# Otherwise, handle intermediate signals
-			else:
-				if verbose: sys.stdout.write('share ')
-				if s:
-					if verbose: sys.stdout.write('bought')
-					bl = (ts, ps)
-					ps = p[list(t).index(max(filter(lambda x: x < ts, t)))]
-					gain -= ps
+		gain, crossadjust, trades = self.backtest(t, p, crossovers, openend)
+
+		if verbose:
+			print()
+			for k, trade in enumerate(trades):
+				if k == 0:
+					sys.stdout.write('share bought')
+				elif k == len(crossadjust) + 1:
+					sys.stdout.write('share sold')
+				elif not trade['executed']:
+					sys.stdout.write('buy signal ignored')
 				else:
-					if verbose: sys.stdout.write('sold')
-					sl = (ts, ps)
-					ps = p[list(t).index(max(filter(lambda x: x < ts, t)))]
-					gain += ps
-			if verbose: print(' on ' + num2date(ts).strftime('%m/%d/%y') + ' for $' + '{0:.2f}'.format(ps))
+					sys.stdout.write('share ' + ('bought' if trade['buy'] else 'sold'))
+				print(' on ' + num2date(trade['t']).strftime('%m/%d/%y') + ' for $' + '{0:.2f}'.format(trade['price']))
+			print('{0:+.2f}'.format(gain))
 
-		# If signals are over and share hasn't been sold yet, sell share on end date:
-		if sl is None or bl[0] > sl[0]:
-			if verbose: print('share sold on ' + num2date(t[len(t)-1]).strftime('%m/%d/%y') + ' for $' + '{0:.2f}'.format(p[len(p)-1]))
-			gain += p[len(p)-1]
-
-		if verbose: print('{0:+.2f}'.format(gain))
+		crossadjust = [(bool(c['buy']), (c['t'], c['p'])) for c in crossadjust]
 
 		return ((gain, 100*gain/p[0]), crossadjust)
 
 	# Calculate PIP when fully invested:
 	def calcPIPFI(self, t, p):
 		return ((p[len(p)-1] - p[0]), 100*(p[len(p)-1] - p[0])/p[0])
+
+	# Align several dated series onto the union of their dates as columns of a NaN padded matrix:
+	def alignSeries(self, dates, values):
+		dates = [np.asarray(date2num(d), dtype=np.float64) for d in dates]
+		union = np.unique(np.concatenate(dates)) if dates else np.empty(0)
+		prices = np.full((len(union), len(dates)), np.nan)
+		for j, (d, v) in enumerate(zip(dates, values)):
+			prices[np.searchsorted(union, d), j] = v
+		return union, prices
+
+	# Compute averages, crossovers, and performance for every column of a (dates x symbols) price matrix,
+	# where openend may be a single flag or one flag per column:
+	def batchSignals(self, dates, prices, nl, nh, dd, avgtype='SMA', openend=True, symbols=None):
+		dates = np.asarray(dates, dtype=np.float64)
+		prices = np.asarray(prices, dtype=np.float64)
+		if prices.ndim == 1: prices = prices[:, None]
+		n, m = prices.shape
+		if symbols is None: symbols = list(range(m))
+		openend = np.broadcast_to(openend, (m,))
+		cols = np.arange(m)
+
+		# Move the valid prices of each column to the top so every column acts as its own series:
+		valid = np.isfinite(prices)
+		order = np.argsort(~valid, axis=0, kind='stable')
+		count = valid.sum(axis=0)
+		live = np.arange(n)[:, None] < count
+		cdates = dates[order]
+		cprice = np.take_along_axis(prices, order, axis=0)
+
+		if avgtype == 'EWMA':
+			cnl = self.EWMA(cprice, nl)
+			cnh = self.EWMA(cprice, nh)
+		else:
+			mas = self.movingAverages(cprice, [nl, nh])
+			cnl = mas[nl][:n]
+			cnh = mas[nh][:n]
+		cnl[~live] = np.nan
+		cnh[~live] = np.nan
+
+		# Trim each column to its last dd days as plotSignals does:
+		last = cdates[np.maximum(count-1, 0), cols]
+		inrange = live & (cdates > last - (dd-1))
+		cut = np.where(inrange.any(axis=0), np.maximum(np.argmax(inrange, axis=0) - 1, 0), 0)
+
+		# Detect sign changes of every column at once, ordered by column then date:
+		i, j = np.nonzero(np.diff(np.sign(cnl - cnh), axis=0))
+		i, j = i[np.lexsort((i, j))], j[np.lexsort((i, j))]
+		keep = (i >= cut[j]) & (i + 1 < count[j]) & (cnl[i, j] != cnh[i, j])
+		i, j = i[keep], j[keep]
+
+		with np.errstate(invalid='ignore', divide='ignore'):
+			# Compute slopes for both short term and long term averages:
+			manlm = (cnl[i+1, j] - cnl[i, j]) / (cdates[i+1, j] - cdates[i, j])
+			manhm = (cnh[i+1, j] - cnh[i, j]) / (cdates[i+1, j] - cdates[i, j])
+
+			# Compute exact time and value of every crossover:
+			t = (cnh[i, j] - cnl[i, j]) / (manlm - manhm) + cdates[i, j]
+			p = manlm * (t - cdates[i, j]) + cnl[i, j]
+
+		# Keep only crossovers within the last dd days of each column:
+		keep = t > last[j] - (dd+1)
+		crossovers = np.empty(np.count_nonzero(keep), dtype=crossoverType)
+		crossovers['buy'] = cnl[i[keep], j[keep]] < cnh[i[keep], j[keep]]
+		crossovers['t'] = t[keep]
+		crossovers['p'] = p[keep]
+		splits = np.searchsorted(j[keep], np.arange(m+1))
+
+		# Compare staying fully invested with following signals over the trimmed range:
+		first = cprice[cut, cols]
+		final = cprice[np.maximum(count-1, 0), cols]
+		invested = np.stack(((final - first), 100*(final - first)/first), axis=1)
+
+		# Restore the averages to the original rows of the matrix:
+		manl = np.full((n, m), np.nan)
+		manh = np.full((n, m), np.nan)
+		np.put_along_axis(manl, order, cnl, axis=0)
+		np.put_along_axis(manh, order, cnh, axis=0)
+
+		results = {}
+		for k, symbol in enumerate(symbols):
+			if count[k] == 0:
+				results[symbol] = None
+				continue
+			signals = crossovers[splits[k]:splits[k+1]]
+			gain, crossadjust, trades = self.backtest(cdates[cut[k]:count[k], k], cprice[cut[k]:count[k], k], signals, openend[k])
+			results[symbol] = {'nl': manl[:, k], 'nh': manh[:, k], 'crossovers': signals, 'crossadjust': crossadjust,
+			                   'invested': tuple(invested[k]), 'signaled': (gain, 100*gain/first[k])}
+		return results
+
+# Incrementally track a simple moving average matching BasicFinance.SMA one bar at a time:
+class RollingSMA:
+	def __init__(self, n):
+		self.n = n
+		self.values = collections.deque()
+		self.total = 0.
+		self.invalid = 0
+		self.count = 0
+
+	# Return the average of the previous n values, then add the new value to the window:
+	def update(self, value):
+		if len(self.values) < self.n or self.invalid > 0: ma = np.nan
+		else:                                             ma = self.total / self.n
+
+		value = float(value)
+		self.values.append(value)
+		if np.isfinite(value): self.total += value
+		else:                  self.invalid += 1
+
+		if len(self.values) > self.n:
+			old = self.values.popleft()
+			if np.isfinite(old): self.total -= old
+			else:                self.invalid -= 1
+
+		# Periodically resum the window so rounding error cannot accumulate:
+		self.count += 1
+		if self.count % max(self.n, 1) == 0:
+			self.total = sum(v for v in self.values if np.isfinite(v))
+
+		return ma
+
+	def getState(self):
+		return {'n': self.n, 'values': list(self.values), 'count': self.count}
+
+	@classmethod
+	def fromState(cls, state):
+		obj = cls(state['n'])
+		for value in state['values']:
+			obj.update(value)
+		obj.count = state['count']
+		return obj
+
+# Incrementally track an exponential weighted moving average matching BasicFinance.EWMA:
+class RollingEWMA:
+	def __init__(self, window, adjust=False):
+		self.window = window
+		self.adjust = adjust
+		self.alpha = 2 / (window + 1.)
+		self.mean = np.nan
+		self.weight = 0.
+
+	# Add the new value and return the updated average, holding it across NaN gaps:
+	def update(self, value):
+		value = float(value)
+		if not np.isfinite(value): return self.mean
+
+		if self.adjust:
+			# Keep the weighted mean normalized by the accumulated weight:
+			self.weight = (1 - self.alpha) * self.weight + 1.
+			if np.isfinite(self.mean): self.mean += (value - self.mean) / self.weight
+			else:                      self.mean  = value
+		else:
+			if np.isfinite(self.mean): self.mean = (1 - self.alpha) * self.mean + self.alpha * value
+			else:                      self.mean = value
+
+		return self.mean
+
+	def getState(self):
+		return {'window': self.window, 'adjust': self.adjust, 'mean': self.mean, 'weight': self.weight}
+
+	@classmethod
+	def fromState(cls, state):
+		obj = cls(state['window'], state['adjust'])
+		obj.mean = state['mean']
+		obj.weight = state['weight']
+		return obj
+
+# Incrementally detect crossovers of two averages matching BasicFinance.detectCrossovers:
+class CrossoverTracker:
+	def __init__(self):
+		self.prev = None
+		self.last = None
+
+	# Add the averages for a new date and return a (bool, (t, p)) signal if they crossed:
+	def update(self, date, manl, manh):
+		date, manl, manh = float(date), float(manl), float(manh)
+		signal = None
+
+		if self.prev is not None:
+			dp, lp, hp = self.prev
+			if np.sign(manl - manh) != np.sign(lp - hp) and lp != hp:
+				# Compute slopes for both short term and long term averages:
+				manlm = (manl - lp) / (date - dp)
+				manhm = (manh - hp) / (date - dp)
+
+				# Compute exact time and value of the crossover:
+				with np.errstate(invalid='ignore', divide='ignore'):
+					t = (hp - lp) / (manlm - manhm) + dp
+					p = manlm * (t - dp) + lp
+
+				# Signal to buy (True) if short term average was below long term:
+				if np.isfinite(t):
+					signal = (lp < hp, (t, p))
+					self.last = signal
+
+		self.prev = (date, manl, manh)
+		return signal
+
+	def getState(self):
+		return {'prev': self.prev, 'last': self.last}
+
+	@classmethod
+	def fromState(cls, state):
+		obj = cls()
+		if state['prev'] is not None: obj.prev = tuple(state['prev'])
+		if state['last'] is not None: obj.last = (state['last'][0], tuple(state['last'][1]))
+		return obj
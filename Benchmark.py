@@ -0,0 +1,206 @@
+import os, sys, io, json, time, argparse, platform, tempfile, subprocess, tracemalloc, contextlib
+import numpy as np
+from datetime import datetime, timedelta
+
+import BasicFinance
+
+# Largest size each benchmark runs at, since some hot paths are still pure Python:
+maxsizes = {'legacySMA': 10**6, 'calendar': 10**4, 'add_series': 10**5, 'plotSignals': 10**4}
+
+# Generate a reproducible random walk of daily closing prices starting in 2000:
+def synthPrices(n, seed):
+	rng = np.random.default_rng(seed)
+	dates = 730120. + np.arange(n, dtype=np.float64)
+	price = 100*np.exp(np.cumsum(rng.normal(0.0002, 0.01, n)))
+	return dates, price
+
+# Generate a reproducible pair of sorted ledgers of dates and running balances:
+def synthLedgers(n, seed):
+	rng = np.random.default_rng(seed)
+	ledgers = []
+	for k in range(2):
+		dates = 730120. + np.cumsum(rng.integers(1, 4, n)).astype(np.float64)
+		ledgers.append((dates.tolist(), np.round(np.cumsum(rng.normal(0, 100, n)), 2).tolist()))
+	return ledgers
+
+# Build every benchmark for a given size as (name, setup) pairs where setup returns the callable to time:
+def benchmarks(bf, n, seed):
+	dates, price = synthPrices(n, seed)
+
+	def legacySMA():
+		from Legacy.SMA import SMA
+		return lambda: SMA(price, 30)
+
+	def averages():
+		return bf.EWMA(price, 10), bf.EWMA(price, 30)
+
+	def crossovers():
+		nl, nh = averages()
+		return bf.detectCrossovers(dates, nl, nh, n)
+
+	def calendar():
+		days = [datetime(2000, 1, 1) + timedelta(days=int(d)) for d in np.random.default_rng(seed).integers(0, 365*20, n)]
+		def lookups():
+			for day in days:
+				bf.getNextTradingDay(day)
+				bf.getTradingDays(day, day + timedelta(days=30))
+		return lookups
+
+	def add_series():
+		from Schwab import add_series
+		(T1, V1), (T2, V2) = synthLedgers(n, seed)
+		return lambda: add_series(T1, V1, T2, V2)
+
+	def pipfs():
+		signals = crossovers()
+		def run():
+			with contextlib.redirect_stdout(io.StringIO()):
+				return bf.calcPIPFS(dates, price, signals)
+		return run
+
+	# Render one signal chart to a scratch directory on the shared figure, without opening a window:
+	def plotSignals():
+		import matplotlib
+		matplotlib.use('Agg')
+		import FinancePlot
+		from matplotlib.dates import num2date
+		class Signals:
+			nl = 10; nh = 30; openEnd = False
+			def printLatestCrossover(self, fund, crossovers): return False
+		t = num2date(dates)
+		scratch = tempfile.TemporaryDirectory()
+		fp = FinancePlot.FinancePlot('Benchmark', n, scratch.name)
+		def run():
+			with contextlib.redirect_stdout(io.StringIO()):
+				fp.plotSignals(Signals(), t, price, 0, 'Benchmark', 'EWMA')
+		return run
+
+	return [('SMA',              lambda: lambda: bf.SMA(price, 30)),
+	        ('legacySMA',        legacySMA),
+	        ('movingAverages',   lambda: lambda: bf.movingAverages(price, [10, 30])),
+	        ('EWMA',             lambda: lambda: bf.EWMA(price, 30)),
+	        ('detectCrossovers', lambda: (lambda nl, nh: lambda: bf.detectCrossovers(dates, nl, nh, n))(*averages())),
+	        ('calcPIPFS',        pipfs),
+	        ('calendar',         calendar),
+	        ('add_series',       add_series),
+	        ('plotSignals',      plotSignals)]
+
+# Time a callable, keeping the best of several repeats, then trace its peak memory in one more call:
+def measure(func, repeat):
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - start
+		if best is None or elapsed < best: best = elapsed
+
+	tracemalloc.start()
+	func()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+
+	return best, peak
+
+def describe():
+	try:
+		commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)), capture_output=True, text=True).stdout.strip()
+	except OSError:
+		commit = None
+	return {'commit': commit, 'date': datetime.now().isoformat(), 'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine()}
+
+def run(sizes, names, seed, repeat, output):
+	bf = BasicFinance.BasicFinance()
+	results = []
+
+	print("%-18s %10s %12s %12s" % ('Benchmark', 'Size', 'Seconds', 'Peak (MB)'))
+	for n in sizes:
+		for name, setup in benchmarks(bf, n, seed):
+			if names and name not in names: continue
+			if n > maxsizes.get(name, n): continue
+
+			try:
+				func = setup()
+			except ImportError as e:
+				print("%-18s %10d %12s" % (name, n, 'skipped (%s)' % e))
+				continue
+
+			seconds, peak = measure(func, repeat)
+			results.append({'name': name, 'size': n, 'seconds': seconds, 'peak': peak})
+			print("%-18s %10d %12.6f %12.2f" % (name, n, seconds, peak/2.**20))
+
+	if output is not None:
+		with open(output, 'w') as fh:
+			json.dump({'meta': describe(), 'seed': seed, 'results': results}, fh, indent=4)
+
+	return results
+
+# Check optimized hot paths against the reference implementations they replaced, returning the number of mismatches:
+def verify(sizes, seed):
+	from Legacy.SMA import SMA
+	bf = BasicFinance.BasicFinance()
+	windows = [1, 10, 30, 200]
+
+	mismatches = 0
+	print("%-18s %10s %8s %14s" % ('Check', 'Size', 'Window', 'Max Error'))
+	for n in sizes:
+		dates, price = synthPrices(n, seed)
+		# Gaps must turn every window covering them into NaN, as np.mean did:
+		price[np.random.default_rng(seed).integers(0, n, max(n//1000, 1))] = np.nan
+
+		mas = bf.movingAverages(price, windows)
+		for w in windows:
+			ref = np.array(SMA(price, w))
+			new = mas[w]
+			same = ref.shape == new.shape and np.array_equal(np.isnan(ref), np.isnan(new)) and np.allclose(ref, new, rtol=1e-9, atol=0., equal_nan=True)
+			error = np.nanmax(np.abs(ref - new) / np.abs(ref)) if ref.shape == new.shape and np.any(~np.isnan(ref)) else np.nan
+			if not same: mismatches += 1
+			print("%-18s %10d %8d %14.3e%s" % ('movingAverages', n, w, error, '' if same else '  MISMATCH'))
+
+	return mismatches
+
+# Compare two result files and report benchmarks slower or larger than the threshold allows:
+def compare(basefile, newfile, threshold):
+	with open(basefile) as fh: base = {(r['name'], r['size']): r for r in json.load(fh)['results']}
+	with open(newfile) as fh: new = {(r['name'], r['size']): r for r in json.load(fh)['results']}
+
+	regressions = 0
+	print("%-18s %10s %12s %12s %8s %8s" % ('Benchmark', 'Size', 'Base (s)', 'New (s)', 'Time', 'Memory'))
+	for key in sorted(set(base) & set(new)):
+		b = base[key]; r = new[key]
+		tratio = r['seconds'] / b['seconds'] if b['seconds'] > 0 else 1.
+		mratio = r['peak'] / b['peak'] if b['peak'] > 0 else 1.
+		flag = ''
+		if tratio > 1 + threshold or mratio > 1 + threshold:
+			flag = '  REGRESSION'
+			regressions += 1
+		print("%-18s %10d %12.6f %12.6f %7.2fx %7.2fx%s" % (key[0], key[1], b['seconds'], r['seconds'], tratio, mratio, flag))
+
+	return regressions
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser()
+	sub = parser.add_subparsers(dest="command")
+	prun = sub.add_parser("run", help="time the benchmarks and optionally save results")
+	prun.add_argument("-n", "--sizes", help="number of points per series", type=int, nargs='+', default=[10**3, 10**4, 10**5, 10**6, 10**7])
+	prun.add_argument("-b", "--benchmarks", help="names of benchmarks to run", nargs='+', default=None)
+	prun.add_argument("-s", "--seed", help="seed for synthetic data", type=int, default=1)
+	prun.add_argument("-r", "--repeat", help="number of timed repeats", type=int, default=3)
+	prun.add_argument("-o", "--output", help="JSON file to write results to", default=None)
+	pchk = sub.add_parser("check", help="check optimized hot paths against their reference implementations")
+	pchk.add_argument("-n", "--sizes", help="number of points per series", type=int, nargs='+', default=[10**3, 10**4, 10**5])
+	pchk.add_argument("-s", "--seed", help="seed for synthetic data", type=int, default=1)
+	pcmp = sub.add_parser("compare", help="compare two saved result files")
+	pcmp.add_argument("base", help="baseline results file")
+	pcmp.add_argument("new", help="new results file")
+	pcmp.add_argument("-t", "--threshold", help="allowed fractional slowdown", type=float, default=0.1)
+	args = parser.parse_args()
+
+	if args.command == "check":
+		sys.exit(1 if verify(args.sizes, args.seed) else 0)
+	elif args.command == "compare":
+		sys.exit(1 if compare(args.base, args.new, args.threshold) else 0)
+	elif args.command == "run":
+		run(args.sizes, args.benchmarks, args.seed, args.repeat, args.output)
+	else:
+		parser.print_help()
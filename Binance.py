@@ -1,6 +1,7 @@
 import os, collections
 import requests, json
 import hmac, hashlib
+import FinanceHTTP
 from datetime import datetime, timezone
 
 # Create file called binanceapi.py and define api_sec, api_key strings
@@ -37,7 +38,7 @@ def create_datetime(timestamp=None):
 
 def verify_response(r):
     if r.status_code != 200:
-        exit("ERROR (CODE %d)!" % r.status_code)
+        raise requests.HTTPError("ERROR (CODE %d)!" % r.status_code, response=r)
 
 def print_used_requests(r):
     time_interval_map = {'s': 'second', 'm': 'minute', 'h': 'hour', 'd': 'day'}
@@ -52,8 +53,8 @@ def print_used_requests(r):
                 time_value  = time_period[:-1]
                 print("  %-2d %-6s -> %6d" % (int(time_value), time_interval_map[time_unit], int(r.headers[head])))
 
-def request_data_without_key(endpoint, params={}):
-    r = requests.get(os.path.join(api_url, endpoint), params=params)
+def request_data_without_key(endpoint, params=None):
+    r = FinanceHTTP.get(os.path.join(api_url, endpoint), params=params, cache='binance-public')
     verify_response(r)
     j = json.loads(r.text)
     if debug: print_used_requests(r)
@@ -64,14 +65,21 @@ def sign_query(payload):
     m = hmac.new(api_sec.encode('utf-8'), query.encode('utf-8'), hashlib.sha256)
     return m.hexdigest()
 
-def request_data_with_key(endpoint, params={}):
-    headers = {"x-mbx-apikey": api_key}
+# Sign a copy of the request parameters with the current time, sending them in the order they were signed:
+def sign_params(kwargs):
+    params = dict(kwargs['params'])
     params['timestamp'] = create_timestamp()
     payload = []
     for k in sorted(params):
         payload.append((k, params[k]))
-    params['signature'] = sign_query(payload)
-    r = requests.get(os.path.join(api_url, endpoint), params=params, headers=headers)
+    signed = collections.OrderedDict(payload)
+    signed['signature'] = sign_query(payload)
+    return dict(kwargs, params=signed)
+
+# Signed requests are signed again before every attempt, so a retry after a backoff stays within recvWindow:
+def request_data_with_key(endpoint, params=None):
+    headers = {"x-mbx-apikey": api_key}
+    r = FinanceHTTP.get(os.path.join(api_url, endpoint), params=dict(params or {}), headers=headers, prepare=sign_params)
     verify_response(r)
     j = json.loads(r.text)
     if debug: print_used_requests(r)
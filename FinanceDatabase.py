@@ -1,39 +1,234 @@
-import sqlite3
+import os, sqlite3, collections, itertools, threading, contextlib, atexit
+import numpy as np
+import pandas as pd
 from datetime import datetime
 
+# Columns stored for every daily bar, keyed by the names used in the quote data dicts:
+columns = collections.OrderedDict([('Open',     'open'),     ('High',     'high'),     ('Low',      'low'),
+                                   ('Close',    'close'),    ('Volume',   'volume'),   ('AdjClose', 'adjclose'),
+                                   ('DivAmnt',  'divamnt'),  ('SplCoeff', 'splcoeff')])
+
+# Hand out one connection per database file and thread, so objects sharing a file share a connection
+# and worker threads never use a connection from another thread. Writers within the process take a
+# lock per file, and writers in other processes are waited for by the busy timeout:
+class ConnectionManager:
+	def __init__(self, timeout=60.0):
+		self.timeout = timeout
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.locks = {}
+		self.opened = []
+
+		atexit.register(self.closeAll)
+
+	# Return the state of the calling thread for a database file, connecting on first use:
+	def state(self, filename):
+		filename = os.path.abspath(filename)
+		states = self.local.__dict__.setdefault('states', {})
+		if filename not in states:
+			# Manage transactions explicitly so that a batch of writes commits once:
+			db = sqlite3.connect(filename, timeout=self.timeout, isolation_level=None, check_same_thread=False,
+			                     detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
+
+			# Let readers proceed while a bulk write is in progress:
+			db.execute("PRAGMA journal_mode=WAL")
+
+			states[filename] = {'db': db, 'depth': 0}
+			with self.lock:
+				self.locks.setdefault(filename, threading.Lock())
+				self.opened.append(db)
+		return states[filename]
+
+	def connect(self, filename):
+		return self.state(filename)['db']
+
+	# Run the enclosed statements in one transaction, joining the transaction of an enclosing block:
+	@contextlib.contextmanager
+	def transaction(self, filename):
+		state = self.state(filename)
+		if state['depth'] > 0:
+			state['depth'] += 1
+			try:
+				yield state['db']
+			finally:
+				state['depth'] -= 1
+			return
+
+		with self.locks[os.path.abspath(filename)]:
+			state['db'].execute("BEGIN IMMEDIATE")
+			state['depth'] = 1
+			try:
+				yield state['db']
+			except BaseException:
+				state['db'].rollback()
+				raise
+			else:
+				state['db'].commit()
+			finally:
+				state['depth'] = 0
+
+	# Close the connection of the calling thread to a database file:
+	def close(self, filename):
+		states = self.local.__dict__.get('states', {})
+		state = states.pop(os.path.abspath(filename), None)
+		if state is not None:
+			with self.lock:
+				self.opened.remove(state['db'])
+			state['db'].close()
+
+	def closeAll(self):
+		with self.lock:
+			opened, self.opened = self.opened, []
+		for db in opened:
+			db.close()
+
+# Process-wide connection manager shared by every FinanceDatabase:
+connections = ConnectionManager()
+
+# Storage backend for prices, either finance.db or the memory-mapped PriceStore when set to "memmap":
+backend = os.environ.get('FINANCE_STORE', 'sqlite')
+
+# Open a price table of the configured backend in the given directory:
+def openStore(path, table):
+	if backend == 'memmap':
+		import PriceStore
+		return PriceStore.PriceStore(os.path.join(path, 'prices'), table)
+	return FinanceDatabase(os.path.join(path, 'finance.db'), table)
+
 class FinanceDatabase:
 	def __init__(self, filename, table):
 
-		self.db = sqlite3.connect(filename, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-		self.c = self.db.cursor()
-
+		self.filename = filename
 		self.table = table
 		self.create()
 
+	# Connection of the calling thread:
+	@property
+	def db(self):
+		return connections.connect(self.filename)
+
+	def transaction(self):
+		return connections.transaction(self.filename)
+
 	def create(self):
-		self.c.execute("CREATE TABLE IF NOT EXISTS " + self.table + "(id INTEGER PRIMARY KEY, symbol TEXT, date TIMESTAMP, close REAL, UNIQUE(symbol, date))")
-		self.db.commit()
+		# Only take the writer lock when a table is missing or still has the old schema:
+		current = [row[1] for row in self.db.execute("PRAGMA table_info(" + self.table + ")")]
+		checked = self.db.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (self.table + "Checked", )).fetchone()
+		if current and 'id' not in current and checked is not None: return
+
+		with self.transaction() as db:
+			# Move a table created with the old close-only schema out of the way before rebuilding it:
+			old = [row[1] for row in db.execute("PRAGMA table_info(" + self.table + ")")]
+			if 'id' in old:
+				db.execute("ALTER TABLE " + self.table + " RENAME TO " + self.table + "_old")
+
+			# Store full daily bars clustered on (symbol, date), so the primary key acts as a
+			# covering index and range scans for one symbol read contiguous rows:
+			db.execute("CREATE TABLE IF NOT EXISTS " + self.table + "(symbol TEXT NOT NULL, date TIMESTAMP NOT NULL, " +
+			           ', '.join("%s %s" % (col, 'INTEGER' if col == 'volume' else 'REAL') for col in columns.values()) +
+			           ", PRIMARY KEY(symbol, date)) WITHOUT ROWID")
+
+			# Track when each symbol was last checked against its source:
+			db.execute("CREATE TABLE IF NOT EXISTS " + self.table + "Checked(symbol TEXT PRIMARY KEY, checked TIMESTAMP)")
+
+			# Copy the closing prices of the old schema into the new table:
+			if 'id' in old:
+				db.execute("INSERT OR IGNORE INTO " + self.table + "(symbol, date, close) SELECT symbol, date, close FROM " + self.table + "_old WHERE symbol IS NOT NULL AND date IS NOT NULL")
+				db.execute("DROP TABLE " + self.table + "_old")
+
+	# Convert dates such as np.datetime64, pandas timestamps or plain dates to the datetime objects sqlite3 stores as TIMESTAMP text:
+	def _dates(self, dates):
+		return [d if type(d) is datetime else pd.Timestamp(d).to_pydatetime() for d in dates]
 
 	def insert(self, symbol, date, close):
-		self.c.execute("INSERT OR IGNORE INTO " + self.table + "(symbol, date, close) VALUES(?,?,?)", (symbol, date, close))
-		self.db.commit()
+		self.insertAll(symbol, [date], [close])
 
 	def insertAll(self, symbol, date, close):
-		self.c.executemany("INSERT OR IGNORE INTO " + self.table + "(symbol, date, close) VALUES(?,?,?)", [[symbol, d, c] for d, c in zip(date, close)])
-		self.db.commit()
+		with self.transaction() as db:
+			db.executemany("INSERT OR IGNORE INTO " + self.table + "(symbol, date, close) VALUES(?,?,?)", [[symbol, d, c] for d, c in zip(self._dates(date), close)])
+
+	# Insert or update every bar in a quote data dict in a single transaction, keeping
+	# stored values for any column the new data does not provide:
+	def upsertBars(self, symbol, data):
+		names = [columns[k] for k in columns if k in data]
+		sql  = "INSERT INTO " + self.table + "(symbol, date, " + ', '.join(names) + ") VALUES(" + ', '.join(['?']*(len(names)+2)) + ")"
+		sql += " ON CONFLICT(symbol, date) DO UPDATE SET " + ', '.join("%s=COALESCE(excluded.%s, %s)" % (n, n, n) for n in names)
+		with self.transaction() as db:
+			db.executemany(sql, zip(itertools.repeat(symbol), self._dates(data['Date']), *[data[k] for k in columns if k in data]))
+
+	def setChecked(self, symbol, checked):
+		with self.transaction() as db:
+			db.execute("INSERT OR REPLACE INTO " + self.table + "Checked(symbol, checked) VALUES(?,?)", (symbol, checked))
+
+	def getChecked(self, symbol):
+		result = self.db.execute("SELECT checked FROM " + self.table + "Checked WHERE symbol=?", (symbol, )).fetchone()
+		if result is None: return None
+		return result[0]
+
+	def fetchSymbols(self):
+		return [row[0] for row in self.db.execute("SELECT DISTINCT symbol FROM " + self.table + " ORDER BY symbol ASC")]
 
 	def fetch(self, symbol, date):
-		self.c.execute("SELECT date, close FROM " + self.table + " WHERE symbol=? AND date=?", (symbol, date))
-		result = self.c.fetch()
+		result = self.db.execute("SELECT date, close FROM " + self.table + " WHERE symbol=? AND date=?", (symbol, date)).fetchone()
+		if result is None: return None
 		return {'Date': result[0], 'Close': result[1]}
 
 	def fetchAll(self, symbol):
-		self.c.execute("SELECT date, close FROM " + self.table + " WHERE symbol=? ORDER BY date ASC", (symbol, ))
-		result = list(zip(*self.c.fetchall()))
+		result = list(zip(*self.db.execute("SELECT date, close FROM " + self.table + " WHERE symbol=? ORDER BY date ASC", (symbol, )).fetchall()))
 		if len(result) > 0:
 			return {'Date': result[0], 'Close': result[1]}
 		else:
 			return None
 
+	# Format a date bound the same way sqlite3 stores TIMESTAMP columns so it compares as text:
+	def _bound(self, dt):
+		if isinstance(dt, np.datetime64): dt = dt.astype('datetime64[us]').astype(object)
+		if not isinstance(dt, datetime): dt = datetime.combine(dt, datetime.min.time())
+		return dt.replace(tzinfo=None).isoformat(' ')
+
+	# Build the SQL for a date range query, leaving out any bound that is None:
+	def _rangeWhere(self, dts, dte):
+		where = ""; params = []
+		if dts is not None:
+			where += " AND date >= ?"
+			params.append(self._bound(dts))
+		if dte is not None:
+			where += " AND date <= ?"
+			params.append(self._bound(dte))
+		return where, params
+
+	# Fetch bars for one symbol between two dates as NumPy arrays, with NaN for missing values:
+	def fetchRange(self, symbol, dts=None, dte=None, names=None):
+		if names is None: names = ['Close']
+		where, params = self._rangeWhere(dts, dte)
+
+		# Read dates as text so no datetime objects are built, then parse them all at once:
+		cur = self.db.execute("SELECT CAST(date AS TEXT), " + ', '.join("IFNULL(%s, 'nan')" % columns[k] for k in names) +
+		                      " FROM " + self.table + " WHERE symbol=?" + where + " ORDER BY date ASC", [symbol] + params)
+		rows = np.fromiter(cur, dtype=[('Date', 'U32')] + [(k, np.float64) for k in names])
+		if len(rows) == 0: return None
+
+		data = {'Date': rows['Date'].astype('datetime64[us]')}
+		for k in names:
+			data[k] = rows[k]
+		return data
+
+	# Fetch one column for several symbols between two dates as a (dates x symbols) matrix with NaN gaps:
+	def fetchMatrix(self, symbols, dts=None, dte=None, name='Close'):
+		where, params = self._rangeWhere(dts, dte)
+
+		cur = self.db.execute("SELECT symbol, CAST(date AS TEXT), IFNULL(%s, 'nan') FROM " % columns[name] + self.table +
+		                      " WHERE symbol IN (" + ', '.join(['?']*len(symbols)) + ")" + where, list(symbols) + params)
+		rows = np.fromiter(cur, dtype=[('symbol', 'U%d' % max([len(s) for s in symbols] + [1])), ('date', 'U32'), ('value', np.float64)])
+
+		# Place every value at the row of its date and the column of its symbol:
+		dates, row = np.unique(rows['date'].astype('datetime64[us]'), return_inverse=True)
+		order = np.argsort(symbols)
+		col = order[np.searchsorted(np.asarray(symbols)[order], rows['symbol'])]
+		matrix = np.full((len(dates), len(symbols)), np.nan)
+		matrix[row, col] = rows['value']
+		return dates, matrix
+
+	# Close the connection of the calling thread, which is shared with other objects using the same file:
 	def close(self):
-		self.db.close()
+		connections.close(self.filename)
@@ -0,0 +1,221 @@
+import os, time, json, random, hashlib, tempfile, threading, collections
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlsplit, urlunsplit
+from datetime import datetime
+
+# Status codes that mean the server is throttling or temporarily failing and the request can be repeated:
+retryStatuses = (429, 500, 502, 503, 504)
+
+# Seconds a cached response stays fresh for each endpoint:
+ttls = { 'alphavantage-daily':     60*60,
+         'alphavantage-intraday':  5*60,
+         'alphavantage-bulk':      24*60*60,
+         'tsp-prices':             60*60,
+         'binance-public':         60,
+         'ynab':                   5*60 }
+
+# Query parameters that hold credentials or change on every request and are left out of cache keys:
+secretParams = {'apikey', 'signature', 'timestamp', 'token'}
+
+class OfflineError(requests.ConnectionError):
+	pass
+
+# Store successful responses on disk keyed by method, normalized URL and parameters without secrets. Every
+# entry is one file holding a JSON header line followed by the body, written atomically. Reading an entry
+# touches its modification time, so the least recently used entries are evicted once the cache exceeds its size:
+class ResponseCache:
+	def __init__(self, directory, maxbytes=256*2**20):
+		self.directory = directory
+		self.maxbytes = maxbytes
+
+	def key(self, method, url, params):
+		parts = urlsplit(url)
+		url = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', '', ''))
+		items = sorted((str(k), str(v)) for k, v in (params.items() if isinstance(params, dict) else params or []) if k not in secretParams)
+		return hashlib.sha256(json.dumps([method.upper(), url, items]).encode()).hexdigest()
+
+	def filename(self, key):
+		return os.path.join(self.directory, key[:2], key + '.bin')
+
+	# Return the cached response and its age in seconds, or None if there is no entry:
+	def load(self, key):
+		filename = self.filename(key)
+		try:
+			with open(filename, 'rb') as fh:
+				meta = json.loads(fh.readline())
+				body = fh.read()
+			os.utime(filename)
+		except (FileNotFoundError, ValueError):
+			return None
+
+		response = requests.Response()
+		response.status_code = meta['status']
+		response.headers = CaseInsensitiveDict(meta['headers'])
+		response.url = meta['url']
+		response.encoding = meta['encoding']
+		response._content = body
+		response.fetched = datetime.fromtimestamp(meta['fetched'])
+		return response, time.time() - meta['fetched']
+
+	def store(self, key, response):
+		filename = self.filename(key)
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		headers = {k: v for k, v in response.headers.items() if k.lower() != 'set-cookie'}
+		meta = {'status': response.status_code, 'headers': headers, 'url': response.url, 'encoding': response.encoding, 'fetched': response.fetched.timestamp()}
+
+		fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.tmp-')
+		try:
+			with os.fdopen(fd, 'wb') as fh:
+				fh.write(json.dumps(meta).encode() + b'\n')
+				fh.write(response.content)
+			os.replace(tmp, filename)
+		except BaseException:
+			os.unlink(tmp)
+			raise
+
+		self.evict()
+
+	# Delete the least recently used entries until the cache fits in its size limit:
+	def evict(self):
+		entries = []
+		for root, dirs, files in os.walk(self.directory):
+			for name in files:
+				if name.startswith('.tmp-'): continue
+				try:
+					stat = os.stat(os.path.join(root, name))
+				except FileNotFoundError:
+					continue
+				entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+
+		total = sum(size for mtime, size, path in entries)
+		for mtime, size, path in sorted(entries):
+			if total <= self.maxbytes: break
+			try:
+				os.unlink(path)
+			except FileNotFoundError:
+				pass
+			total -= size
+
+# Share keep-alive connection pools between every API client, retrying throttled and failed requests with
+# exponential backoff and full jitter. Sessions are kept per thread, since a requests session is not
+# guaranteed to be thread-safe, and latencies are recorded per host:
+class HTTPClient:
+	def __init__(self, timeout=(5.0, 30.0), retries=4, backoff=0.5, maxbackoff=30.0, poolsize=10, history=1000, cache=None, offline=False):
+		self.cache = cache
+		self.offline = offline
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		self.maxbackoff = maxbackoff
+		self.poolsize = poolsize
+
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.stats = collections.defaultdict(lambda: {'requests': 0, 'retries': 0, 'errors': 0, 'latency': collections.deque(maxlen=history)})
+
+	# Return the session of the calling thread, creating its connection pools on first use:
+	def session(self):
+		if not hasattr(self.local, 'session'):
+			session = requests.Session()
+			adapter = HTTPAdapter(pool_connections=self.poolsize, pool_maxsize=self.poolsize)
+			session.mount('https://', adapter)
+			session.mount('http://', adapter)
+			self.local.session = session
+		return self.local.session
+
+	# Return how long to wait before a repeated attempt, honouring a numeric Retry-After header:
+	def delay(self, attempt, response=None):
+		if response is not None:
+			try:
+				return min(float(response.headers['Retry-After']), self.maxbackoff)
+			except (KeyError, ValueError):
+				pass
+		return random.uniform(0, min(self.maxbackoff, self.backoff*2**attempt))
+
+	def record(self, host, latency=None, retry=False, error=False):
+		with self.lock:
+			stats = self.stats[host]
+			if latency is not None:
+				stats['requests'] += 1
+				stats['latency'].append(latency)
+			if retry: stats['retries'] += 1
+			if error: stats['errors'] += 1
+
+	# Send a request and return the final response, raising the last connection error if every attempt failed.
+	# Responses of endpoints named by cache are served from disk while fresh, and only from disk when offline.
+	# Successful responses are stored unless a valid callable rejects them, such as a throttling notice sent
+	# with status 200. A throttle callable runs before every attempt that goes out to the network, and a prepare
+	# callable returns the keyword arguments of every attempt, so signed requests carry a fresh timestamp:
+	def request(self, method, url, timeout=None, cache=None, throttle=None, valid=None, prepare=None, **kwargs):
+		key = None
+		if cache is not None and self.cache is not None:
+			key = self.cache.key(method, url, kwargs.get('params'))
+			cached = self.cache.load(key)
+			if cached is not None and (self.offline or cached[1] < ttls[cache]):
+				return cached[0]
+		if self.offline:
+			raise OfflineError("No cached response for %s while offline" % url)
+
+		response = self.send(method, url, timeout, throttle, prepare, **kwargs)
+		if key is not None and response.status_code == 200 and (valid is None or valid(response)):
+			self.cache.store(key, response)
+		return response
+
+	def send(self, method, url, timeout=None, throttle=None, prepare=None, **kwargs):
+		host = urlsplit(url).netloc
+		if timeout is None: timeout = self.timeout
+
+		for attempt in range(self.retries+1):
+			last = attempt == self.retries
+			if throttle is not None: throttle()
+			args = kwargs if prepare is None else prepare(kwargs)
+			start = time.perf_counter()
+			try:
+				response = self.session().request(method, url, timeout=timeout, **args)
+			except (requests.ConnectionError, requests.Timeout):
+				self.record(host, error=True, retry=not last)
+				if last: raise
+				time.sleep(self.delay(attempt))
+				continue
+
+			response.fetched = datetime.now()
+			self.record(host, time.perf_counter() - start)
+			if response.status_code not in retryStatuses or last:
+				return response
+
+			self.record(host, retry=True)
+			time.sleep(self.delay(attempt, response))
+
+	def get(self, url, **kwargs):
+		return self.request('GET', url, **kwargs)
+
+	def post(self, url, **kwargs):
+		return self.request('POST', url, **kwargs)
+
+	# Summarize request counts and latencies in seconds for every host contacted:
+	def getStats(self):
+		with self.lock:
+			summary = {}
+			for host, stats in self.stats.items():
+				latency = np.array(stats['latency'])
+				summary[host] = {'requests': stats['requests'], 'retries': stats['retries'], 'errors': stats['errors']}
+				if len(latency) > 0:
+					summary[host].update({'mean': latency.mean(), 'p50': np.percentile(latency, 50), 'p95': np.percentile(latency, 95), 'max': latency.max()})
+			return summary
+
+	def printStats(self):
+		print("%-30s %8s %8s %8s %9s %9s %9s" % ('Host', 'Requests', 'Retries', 'Errors', 'Mean (s)', 'P95 (s)', 'Max (s)'))
+		for host, stats in sorted(self.getStats().items()):
+			line = "%-30s %8d %8d %8d" % (host, stats['requests'], stats['retries'], stats['errors'])
+			if 'mean' in stats: line += " %9.3f %9.3f %9.3f" % (stats['mean'], stats['p95'], stats['max'])
+			print(line)
+
+# Process-wide client shared by every API module, working offline when FINANCE_OFFLINE is set:
+client = HTTPClient(cache=ResponseCache(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'cache', 'http')),
+                    offline=bool(os.environ.get('FINANCE_OFFLINE')))
+
+def get(url, **kwargs):
+	return client.get(url, **kwargs)
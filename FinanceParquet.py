@@ -0,0 +1,191 @@
+import os, re, sys, json, sqlite3, argparse
+import numpy as np
+from datetime import datetime
+
+# Parquet support is optional, install with "pip install pyarrow":
+try:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+	import pyarrow.dataset as ds
+except ImportError:
+	pa = None
+
+import FinanceDatabase
+
+# Schema of the ledger written by BinanceHistory.py:
+binanceTable = "CREATE TABLE IF NOT EXISTS binance (id TEXT PRIMARY KEY UNIQUE, datetime TEXT, category TEXT, operation TEXT, pass TEXT, pqty REAL, pval REAL, bass TEXT, bqty REAL, bval REAL, qass TEXT, qqty REAL, qval REAL, fass TEXT, fqty REAL, fval REAL)"
+binanceDatefmt = '%Y-%m-%d %H:%M:%S'
+
+def _require():
+	if pa is None:
+		raise ImportError("pyarrow is required for Parquet export and import")
+
+# Write a table as a Parquet dataset partitioned into one directory per key and year:
+def _writeDataset(table, outdir, partitions):
+	pq.write_to_dataset(table, outdir, partition_cols=partitions, existing_data_behavior='delete_matching')
+
+# Read a partitioned Parquet dataset back into one table, restoring the partition columns with the given types:
+def _readDataset(indir, partitions):
+	partitioning = ds.partitioning(pa.schema(partitions), flavor='hive')
+	return ds.dataset(indir, format='parquet', partitioning=partitioning, exclude_invalid_files=True).to_table()
+
+# Add a year column computed from a timestamp column for partitioning:
+def _withYear(table, column):
+	return table.append_column('year', pa.array(table.column(column).to_numpy().astype('datetime64[Y]').astype(np.int64) + 1970, pa.int16()))
+
+# Export every bar of a FinanceDatabase table partitioned by symbol and year, with checked times alongside:
+def exportPrices(dbfile, table, outdir):
+	_require()
+	fd = FinanceDatabase.FinanceDatabase(dbfile, table)
+	names = list(FinanceDatabase.columns)
+
+	parts = []
+	for symbol in fd.fetchSymbols():
+		data = fd.fetchRange(symbol, names=names)
+		if data is None: continue
+		part = {'symbol': pa.array([symbol]*len(data['Date']), pa.string()), 'date': pa.array(data['Date'], pa.timestamp('us'))}
+		for k in names:
+			part[FinanceDatabase.columns[k]] = pa.array(data[k], pa.float64(), from_pandas=True)
+		parts.append(pa.table(part))
+	if not parts: return 0
+
+	prices = _withYear(pa.concat_tables(parts), 'date')
+	_writeDataset(prices, outdir, ['symbol', 'year'])
+
+	# Underscore files are skipped when the dataset is read back:
+	checked = [(symbol, fd.getChecked(symbol)) for symbol in fd.fetchSymbols()]
+	pq.write_table(pa.table({'symbol': pa.array([c[0] for c in checked], pa.string()),
+	                         'checked': pa.array([c[1] for c in checked], pa.timestamp('us'))}), os.path.join(outdir, '_checked.parquet'))
+	return prices.num_rows
+
+# Seed a FinanceDatabase table from an exported dataset in a single transaction:
+def importPrices(dbfile, table, indir):
+	_require()
+	fd = FinanceDatabase.FinanceDatabase(dbfile, table)
+	prices = _readDataset(indir, [('symbol', pa.string()), ('year', pa.int16())]).sort_by([('symbol', 'ascending'), ('date', 'ascending')])
+
+	symbols = prices.column('symbol').to_numpy(zero_copy_only=False).astype(str)
+	dates = prices.column('date').to_numpy().astype('datetime64[us]')
+	starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]])
+	ends = np.r_[starts[1:], len(symbols)]
+
+	with fd.transaction():
+		for lo, hi in zip(starts, ends):
+			data = {'Date': dates[lo:hi].astype(object).tolist()}
+			for k, col in FinanceDatabase.columns.items():
+				if col in prices.column_names:
+					data[k] = prices.column(col).slice(lo, hi-lo).to_numpy(zero_copy_only=False).astype(np.float64).tolist()
+			fd.upsertBars(symbols[lo], data)
+
+		checkfile = os.path.join(indir, '_checked.parquet')
+		if os.path.exists(checkfile):
+			for row in pq.read_table(checkfile).to_pylist():
+				if row['checked'] is not None:
+					fd.setChecked(row['symbol'], row['checked'])
+	return prices.num_rows
+
+# Export the Binance ledger partitioned by year:
+def exportBinance(dbfile, outdir):
+	_require()
+	con = sqlite3.connect(dbfile)
+	cur = con.execute("SELECT * FROM binance ORDER BY datetime ASC")
+	names = [d[0] for d in cur.description]
+	rows = list(zip(*cur.fetchall()))
+	con.close()
+	if not rows: return 0
+
+	ledger = {}
+	for name, values in zip(names, rows):
+		if name == 'datetime': ledger[name] = pa.array([datetime.strptime(v, binanceDatefmt) for v in values], pa.timestamp('s'))
+		else:                  ledger[name] = pa.array(values)
+	ledger = _withYear(pa.table(ledger), 'datetime')
+	_writeDataset(ledger, outdir, ['year'])
+	return ledger.num_rows
+
+# Import a Binance ledger dataset, ignoring rows whose id is already stored:
+def importBinance(dbfile, indir):
+	_require()
+	ledger = _readDataset(indir, [('year', pa.int16())]).drop(['year'])
+	ledger = ledger.set_column(ledger.column_names.index('datetime'), 'datetime',
+	                           pa.array([dt.strftime(binanceDatefmt) for dt in ledger.column('datetime').to_pylist()], pa.string()))
+
+	con = sqlite3.connect(dbfile)
+	with con:
+		con.execute(binanceTable)
+		con.executemany("INSERT OR IGNORE INTO binance(" + ', '.join(ledger.column_names) + ") VALUES(" + ', '.join(['?']*ledger.num_columns) + ")",
+		                zip(*[ledger.column(name).to_pylist() for name in ledger.column_names]))
+	con.close()
+	return ledger.num_rows
+
+# Export the transactions of a Schwab history file partitioned by account and year:
+def exportSchwab(trnfile, outdir):
+	_require()
+	from Schwab import read_transactions
+	csvinfo, csvhead, csvdata, csvtail = read_transactions(trnfile)
+
+	# Name the account after the number in the file header, falling back on the file name:
+	match = re.search(r'account\s+(\S+)', csvinfo, re.IGNORECASE)
+	account = match.group(1) if match else os.path.splitext(os.path.basename(trnfile))[0]
+
+	columns = list(zip(*csvdata))
+	ledger = {'account': pa.array([account]*len(csvdata), pa.string())}
+	for k, name in enumerate(csvhead):
+		if k < 2: ledger[name] = pa.array([datetime.strptime(v, "%m/%d/%Y") if v else None for v in columns[k]], pa.timestamp('s'))
+		elif k < 5: ledger[name] = pa.array(columns[k], pa.string())
+		else:       ledger[name] = pa.array(columns[k], pa.float64())
+	ledger = _withYear(pa.table(ledger), csvhead[0])
+	_writeDataset(ledger, outdir, ['account', 'year'])
+	return ledger.num_rows
+
+# Export the cached YNAB transactions JSON partitioned by account and year, with amounts already in dollars:
+def exportYNAB(jsonfile, outdir):
+	_require()
+	with open(jsonfile) as fh:
+		transactions = json.load(fh)
+	if not transactions: return 0
+
+	# Keep scalar fields only, since split transactions nest lists of subtransactions:
+	names = [k for k, v in transactions[0].items() if not isinstance(v, (list, dict))]
+	ledger = {'account': pa.array([t['account_name'] for t in transactions], pa.string())}
+	for name in names:
+		if name == 'date': ledger[name] = pa.array([datetime.strptime(t[name], "%Y-%m-%d") for t in transactions], pa.timestamp('s'))
+		else:              ledger[name] = pa.array([t.get(name) for t in transactions])
+	ledger = _withYear(pa.table(ledger), 'date')
+	_writeDataset(ledger, outdir, ['account', 'year'])
+	return ledger.num_rows
+
+if __name__ == "__main__":
+
+	script = os.path.dirname(os.path.realpath(__file__))
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("command", help="direction of the transfer", choices=['export', 'import'])
+	parser.add_argument("kind", help="kind of data to transfer", choices=['prices', 'binance', 'schwab', 'ynab'])
+	parser.add_argument("path", help="directory of the partitioned Parquet dataset")
+	parser.add_argument("-s", "--source", help="database, Schwab transactions CSV or YNAB transactions JSON file", default=None)
+	parser.add_argument("-t", "--table", help="FinanceDatabase table for prices", default='AlphaVantage')
+	args = parser.parse_args()
+
+	if pa is None:
+		print("Please install pyarrow to export and import Parquet files.")
+		sys.exit(1)
+
+	if args.command == 'import' and args.kind in ['schwab', 'ynab']:
+		parser.error("%s transactions are read from their own exports and can only be exported" % args.kind.capitalize())
+	if args.kind in ['schwab', 'ynab'] and args.source is None:
+		parser.error("the %s export needs a --source file" % args.kind.capitalize())
+
+	if args.kind == 'prices':
+		source = args.source or os.path.join(script, 'finance.db')
+		if args.command == 'export': rows = exportPrices(source, args.table, args.path)
+		else:                        rows = importPrices(source, args.table, args.path)
+	elif args.kind == 'binance':
+		source = args.source or 'binance.db'
+		if args.command == 'export': rows = exportBinance(source, args.path)
+		else:                        rows = importBinance(source, args.path)
+	elif args.kind == 'schwab':
+		rows = exportSchwab(args.source, args.path)
+	else:
+		rows = exportYNAB(args.source, args.path)
+
+	print("%sed %d rows" % (args.command.capitalize(), rows))
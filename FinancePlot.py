@@ -6,19 +6,97 @@ try:
 except KeyError:
 	matplotlib.use('Agg')
 
-import sys
+import sys, time
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.dates import date2num, num2date, MonthLocator, DateFormatter
 from matplotlib.ticker import FormatStrFormatter
-from datetime import datetime, timedelta
+from datetime import datetime
 from dateutil import tz
 
 import BasicFinance
 
+# Peak resident memory is read from the resource module where /proc is not available:
+try:
+	import resource
+except ImportError:
+	resource = None
+
 # Set default font size for plots
 plt.rcParams.update({'font.size': 12})
 
+# Render time in seconds of every signal chart drawn by this process, and the resident memory in bytes each
+# chart added when FINANCE_RENDER_RSS is set:
+renderStats = []
+measureRSS = bool(os.environ.get('FINANCE_RENDER_RSS'))
+
+# Return the resident memory of this process in bytes from /proc, falling back on the peak resident memory
+# reported by the resource module, or None if the platform reports neither:
+def residentBytes():
+	try:
+		with open('/proc/self/statm') as fh:
+			return int(fh.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError, IndexError):
+		pass
+	if resource is None: return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Linux reports kilobytes while macOS reports bytes:
+	return peak if sys.platform == 'darwin' else peak*1024
+
+# Set tick intervals, formats and labels shared by every chart:
+def formatAxes(ax):
+	ax.xaxis.set_major_locator(MonthLocator(range(1, 13), bymonthday=1, interval=1))
+	ax.xaxis.set_major_formatter(DateFormatter("%b %Y"))
+	#ax.xaxis.set_minor_locator(MonthLocator(range(1, 13), bymonthday=1, interval=1))
+	ax.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+	ax.set_xlabel('Close Date')
+	ax.set_ylabel('Share Value ($)')
+	ax.grid(True, which='both')
+
+# One figure reused for every signal chart drawn by a process. Axes formatting is set once and each chart only
+# swaps the data and labels of the existing price, average and signal artists, so the figure is never rebuilt:
+class SignalChart:
+	def __init__(self):
+		self.fig, self.ax = plt.subplots(figsize=(1920*10/1080.0, 10))
+		formatAxes(self.ax)
+
+		# Close values and the short and long term averages:
+		self.curves = [self.ax.step([], [], '-', where="post")[0] for k in range(3)]
+
+		# Buy and sell signals as (artist, label, list of signals to take, whether to take buys):
+		self.markers = [(self.ax.plot([], [], 'o', mew=1, color='g', mec='k', markersize=7.0)[0], "Buy Signaled",  0, True),
+		                (self.ax.plot([], [], 'X', mew=1, color='g', mec='k', markersize=8.5)[0], "Buy Settled",   1, True),
+		                (self.ax.plot([], [], 'o', mew=1, color='r', mec='k', markersize=7.0)[0], "Sell Signaled", 0, False),
+		                (self.ax.plot([], [], 'X', mew=1, color='r', mec='k', markersize=8.5)[0], "Sell Settled",  1, False)]
+
+	# Swap in the series of one chart, hiding signal markers that have no points, and rescale the value axis:
+	def update(self, dates, curves, labels, signals):
+		self.ax.set_xlim([dates[0], dates[-1]])
+		for line, values, label in zip(self.curves, curves, labels):
+			line.set_data(dates, values)
+			line.set_label(label)
+
+		for marker, label, k, buy in self.markers:
+			points = [s[1] for s in signals[k] if s[0] == buy]
+			marker.set_data([pt[0] for pt in points], [pt[1] for pt in points])
+			marker.set_visible(len(points) > 0)
+			marker.set_label(label if points else '_' + label)
+
+		self.ax.relim(visible_only=True)
+		self.ax.autoscale_view(scalex=False)
+
+	def isOpen(self):
+		return plt.fignum_exists(self.fig.number)
+
+_chart = None
+
+# Return the shared signal chart, building it again if its window has been closed since the last chart:
+def signalChart():
+	global _chart
+	if _chart is None or not _chart.isOpen():
+		_chart = SignalChart()
+	return _chart
+
 class FinancePlot:
 	def __init__(self, source, dd, imgpath):
 		self.source = source
@@ -38,28 +116,20 @@ class FinancePlot:
 	def setupPlot(self, t):
 		self.t = t
 
-		# Define figure and axes handles:
+		# Define figure and axes handles with tick intervals, formats, labels and gridlines:
 		self.fig, self.ax = plt.subplots(figsize=(1920*10/1080.0, 10))
+		formatAxes(self.ax)
 
-		# Set limits and tick intervals on the time axis:
-		self.ax.xaxis.set_major_locator(MonthLocator(range(1, 13), bymonthday=1, interval=1))
-		self.ax.xaxis.set_major_formatter(DateFormatter("%b %Y"))
-		#self.ax.xaxis.set_minor_locator(MonthLocator(range(1, 13), bymonthday=1, interval=1))
-		self.ax.yaxis.set_major_formatter(FormatStrFormatter('%.2f'))
+		# Set limits on the time axis:
 		self.ax.set_xlim([date2num(min(self.t)), date2num(max(self.t))])
 
 		# Create a directory to store images if it does not already exist:
 		if not os.path.exists(self.imgpath): os.makedirs(self.imgpath)
 
-		# Set labels for axes:
-		self.ax.set_xlabel('Close Date')
-		self.ax.set_ylabel('Share Value ($)')
-
 	def definePlotLegend(self):
-		# Display legend as well as major and minor gridlines:
+		# Display legend, replacing the legend of a previous chart:
 		handles, labels = self.ax.get_legend_handles_labels()
 		self.ax.legend(handles, labels, loc=8, ncol=len(labels), fontsize=12)
-		self.ax.grid(which='both')
 
 	def genPlotTitle(self, fund, updated=None):
 		title  = "%s %s from %s to %s" % (self.source, fund, self.bf.formatDate(min(self.t)), self.bf.formatDate(max(self.t)))
@@ -82,19 +152,15 @@ class FinancePlot:
 		dates = np.array(date2num(t))
 		price = np.array(p)
 		if avgtype == 'SMA':
-			nl = np.array(self.bf.SMA(p, finObj.nl))
-			nh = np.array(self.bf.SMA(p, finObj.nh))
+			mas = self.bf.movingAverages(p, [finObj.nl, finObj.nh])
+			nl = mas[finObj.nl]
+			nh = mas[finObj.nh]
 		elif avgtype == 'EWMA':
 			nl = np.array(self.bf.EWMA(p, finObj.nl))
 			nh = np.array(self.bf.EWMA(p, finObj.nh))
 
 		# Determine which datapoints are out of range:
-		cut = 0
-		for i, date in enumerate(dates):
-			if date > date2num(max(t)-timedelta(days=self.dd-1)):
-				cut = i - 1
-				if cut < 0: cut = 0
-				break
+		cut = self.bf.getCutIndex(dates, self.dd)
 
 		# Trim all data points to be in range:
 		t = t[cut:]
@@ -103,15 +169,6 @@ class FinancePlot:
 		nl = nl[cut:]
 		nh = nh[cut:]
 
-		# Initialize plot:
-		fp = FinancePlot(self.source, self.dd, self.imgpath)
-		fp.setupPlot(t)
-
-		# Set relevant titles for window, figure, and axes:
-		fp.genPlotTitle(fund, updateTime)
-		fig = fp.getFig()
-		ax = fp.getAx()
-
 		# Avoid duplication of word fund in name:
 		if "fund" in fund.lower(): fundname = fund.capitalize()
 		else:                      fundname = fund + " fund"
@@ -147,27 +204,46 @@ class FinancePlot:
 			sys.stdout.write('{0:+7.2f}'.format(data[0]).replace('-', '-$').replace('+', '+$'))
 			print('  {0:+7.2f}%'.format(data[1]))
 	
-		# Plot price and short term and long term moving averages:
-		try: ax.step(num2date(dates, tz=tz.tzutc()), price, '-', label="Close Values", where="post")
-		except (ValueError, TypeError): print("[WARN] Exception during close value plotting")
-		try: ax.step(num2date(dates, tz=tz.tzutc()), nl,    '-', label="%d Day %s" % (finObj.nl, avgtype), where="post")
-		except (ValueError, TypeError): print("[WARN] Exception during short term average plotting")
-		try: ax.step(num2date(dates, tz=tz.tzutc()), nh,    '-', label="%d Day %s" % (finObj.nh, avgtype), where="post")
-		except (ValueError, TypeError): print("[WARN] Exception during long term average plotting")
-
-		# Plot buy and sell crossover signals:
-		if crossovers:
-			try: ax.plot_date(*zip(*[s[1] for s in crossovers  if     s[0]]), fmt='o', mew=1, color='g', mec='k', markersize=7.0, label="Buy Signaled")
-			except (ValueError, TypeError): print("[WARN] Exception during buy signal plotting")
-			try: ax.plot_date(*zip(*[s[1] for s in crossadjust if     s[0]]), fmt='X', mew=1, color='g', mec='k', markersize=8.5, label="Buy Settled")
-			except (ValueError, TypeError): print("[WARN] Exception during buy settle plotting")
-			try: ax.plot_date(*zip(*[s[1] for s in crossovers  if not s[0]]), fmt='o', mew=1, color='r', mec='k', markersize=7.0, label="Sell Signaled")
-			except (ValueError, TypeError): print("[WARN] Exception during sell signal plotting")
-			try: ax.plot_date(*zip(*[s[1] for s in crossadjust if not s[0]]), fmt='X', mew=1, color='r', mec='k', markersize=8.5, label="Sell Settled")
-			except (ValueError, TypeError): print("[WARN] Exception during sell settle plotting")
-
-		# Define plot legend and add gridlines:
-		fp.definePlotLegend()
+		# Plot price, moving averages and crossover signals on the shared figure, using the dates converted once above:
+		rss = residentBytes() if measureRSS else None
+		start = time.perf_counter()
+		chart = signalChart()
+		self.fig, self.ax, self.t = chart.fig, chart.ax, t
+		chart.update(dates, [price, nl, nh], ["Close Values", "%d Day %s" % (finObj.nl, avgtype), "%d Day %s" % (finObj.nh, avgtype)], [crossovers, crossadjust])
+
+		# Set relevant titles for window, figure, and axes:
+		self.genPlotTitle(fund, updateTime)
+
+		# Define plot legend:
+		self.definePlotLegend()
+
+		# Save a copy of the plot in the imgpath directory:
+		if not os.path.exists(self.imgpath): os.makedirs(self.imgpath)
+		self.fig.savefig(os.path.join(self.imgpath, (fund + '.png').replace(' ', '')), bbox_inches='tight')
+		stats = {'fund': fund, 'seconds': time.perf_counter() - start}
+
+		# Sample resident memory after the timed render, including native buffers such as the Agg raster:
+		if rss is not None:
+			after = residentBytes()
+			stats['rss'] = None if after is None else after - rss
+		renderStats.append(stats)
+
+		# Display the plot, which keeps the figure for the next chart unless its window is closed:
+		plt.show(block=True)
+
+	# Plot stitched equity curves, such as a walk-forward run, normalized to a starting value of one:
+	def plotEquity(self, dates, curves, fund):
+		t = num2date(dates, tz=tz.tzutc())
+		self.setupPlot(t)
+		self.genPlotTitle(fund)
+		self.ax.set_ylabel('Growth of $1')
+
+		for label, curve in curves.items():
+			try: self.ax.step(t, curve, '-', label=label, where="post")
+			except (ValueError, TypeError): print("[WARN] Exception during %s plotting" % label.lower())
+
+		# Define plot legend:
+		self.definePlotLegend()
 
 		# Save a copy of the plot in the imgpath directory:
 		plt.savefig(os.path.join(self.imgpath, (fund + '.png').replace(' ', '')), bbox_inches='tight')
@@ -177,3 +253,23 @@ class FinancePlot:
 
 		# Close the plot:
 		plt.close()
+
+	# Print a one line summary of the latest signal and performance for every symbol of a batch:
+	def printBatchSignals(self, results):
+		print('{0:12s}  {1:30s}  {2:>19s}  {3:>19s}  {4:>19s}'.format('Symbol', 'Latest Crossover', 'Invested', 'Signaled', 'Variance'))
+		for symbol, result in results.items():
+			if result is None:
+				print('{0:12s}  No data available!'.format(symbol))
+				continue
+
+			if len(result['crossovers']):
+				s = result['crossovers'][-1]
+				latest = ('B ' if s['buy'] else 'S ') + self.bf.formatDate(num2date(s['t'])) + ' @ ${0:.2f}'.format(s['p'])
+			else:
+				latest = 'None within ' + str(self.dd) + ' days!'
+
+			sys.stdout.write('{0:12s}  {1:30s}'.format(str(symbol), latest))
+			for data in [result['invested'], result['signaled'], np.subtract(result['signaled'], result['invested'])]:
+				sys.stdout.write('  ' + '{0:+9.2f}'.format(data[0]).replace('-', '-$').replace('+', '+$'))
+				sys.stdout.write(' {0:+7.2f}%'.format(data[1]))
+			print()
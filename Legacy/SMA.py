@@ -0,0 +1,11 @@
+import numpy as np
+
+# Simple moving average as BasicFinance computed it before movingAverages, kept as a reference for Benchmark.py:
+def SMA(l, n):
+	# Start with empty list and fill invalid values first:
+	ma = [np.nan]*n
+	# Move through the valid positions in list and compute moving average:
+	for i in range(n, len(l)):
+		ma.append(np.mean(l[i-n:i]))
+	# Return result
+	return ma
@@ -0,0 +1,231 @@
+import os, sys, argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from matplotlib.dates import date2num, num2date
+from datetime import datetime, timedelta
+
+import BasicFinance, FinancePlot
+
+# Structured array layout for the ranked sweep results:
+resultType = np.dtype([('avgtype', 'U4'), ('nl', np.int64), ('nh', np.int64), ('signals', np.int64),
+                       ('invested', np.float64), ('investedpct', np.float64),
+                       ('signaled', np.float64), ('signaledpct', np.float64)])
+
+# Structured array layout for the walk-forward windows:
+windowType = np.dtype([('train', np.float64), ('test', np.float64), ('end', np.float64), ('nl', np.int64), ('nh', np.int64),
+                       ('trainpct', np.float64), ('testpct', np.float64), ('investedpct', np.float64)])
+
+# Arrays shared with every worker process, set once by the pool initializer:
+_shared = {}
+
+def _initWorker(dates, price, mas, dd, openend):
+	_shared.update({'dates': dates, 'price': price, 'mas': mas, 'dd': dd, 'openend': openend})
+
+# Copy an array into a shared memory block and return the block and a picklable descriptor:
+def _shareArray(a):
+	shm = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+	np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf)[...] = a
+	return shm, (shm.name, a.shape, a.dtype.str)
+
+# Attach to shared memory blocks instead of receiving pickled copies of the price arrays:
+def _initSharedWorker(dates, price, mas, openend):
+	for key, (name, shape, dtype) in [('dates', dates), ('price', price), ('mas', mas)]:
+		shm = shared_memory.SharedMemory(name=name)
+		_shared[key + 'shm'] = shm
+		_shared[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+	_shared['openend'] = openend
+
+# Pick the best pair on a train slice of the shared arrays and follow it over the next test slice:
+def _evaluateWindow(window):
+	bf = BasicFinance.BasicFinance()
+	(a, b, c), pairs = window
+	dates, price, mas, openend = _shared['dates'], _shared['price'], _shared['mas'], _shared['openend']
+
+	# Backtest every pair over the train slice, keeping every crossover within it:
+	best = None
+	for il, ih in pairs:
+		crossovers = bf.detectCrossoverArray(dates[a:b], mas[a:b, il], mas[a:b, ih], dates[b-1] - dates[a] + 1)
+		gain = bf.backtest(dates[a:b], price[a:b], crossovers, openend)[0]
+		if best is None or gain > best[0]: best = (gain, il, ih)
+	gain, il, ih = best
+
+	# Follow the chosen pair over the test slice and mark the position to market every day:
+	crossovers = bf.detectCrossoverArray(dates[b:c], mas[b:c, il], mas[b:c, ih], dates[c-1] - dates[b] + 1)
+	test, _, trades = bf.backtest(dates[b:c], price[b:c], crossovers, openend)
+	k = np.searchsorted(trades['index'], np.arange(c - b), side='right') - 1
+	equity = 1 + (trades['gain'][k] + trades['position'][k]*price[b:c]) / price[b]
+
+	return (il, ih, 100*gain/price[a], 100*test/price[b]), equity
+
+# Backtest a batch of (avgtype, short column, long column) pairs against the shared averages:
+def _evaluatePairs(pairs):
+	bf = BasicFinance.BasicFinance()
+	dates, price, dd, openend = _shared['dates'], _shared['price'], _shared['dd'], _shared['openend']
+
+	results = np.empty((len(pairs), 2))
+	for k, (avgtype, il, ih) in enumerate(pairs):
+		mas = _shared['mas'][avgtype]
+		crossovers = bf.detectCrossoverArray(dates, mas[:, il], mas[:, ih], dd)
+		gain = bf.backtest(dates, price, crossovers, openend)[0]
+		results[k] = (gain, len(crossovers))
+	return results
+
+class ParameterSweep:
+	def __init__(self, t, p, dd, openend=True, avgtypes=('SMA', 'EWMA'), workers=None):
+		self.bf = BasicFinance.BasicFinance()
+
+		self.dates = np.array(date2num(t), dtype=np.float64)
+		self.price = np.array(p, dtype=np.float64)
+		self.dd = dd
+		self.openend = openend
+		self.avgtypes = avgtypes
+		self.workers = workers
+
+	# Backtest every pair of short and long windows and return results ranked by signaled gain:
+	def run(self, nls, nhs, chunksize=64):
+		windows = sorted(set(nls) | set(nhs))
+		column = {n: i for i, n in enumerate(windows)}
+		pairs = [(avgtype, nl, nh) for avgtype in self.avgtypes for nl in nls for nh in nhs if nl < nh]
+
+		# Compute all moving averages in one batched pass, then trim to the last dd days:
+		cut = self.bf.getCutIndex(self.dates, self.dd)
+		dates = self.dates[cut:]
+		price = self.price[cut:]
+		mas = {avgtype: np.ascontiguousarray(self.bf.movingAverageMatrix(self.price, windows, avgtype)[cut:]) for avgtype in self.avgtypes}
+
+		# Split the grid into batches and backtest them across a process pool:
+		tasks = [[(a, column[nl], column[nh]) for a, nl, nh in pairs[i:i+chunksize]] for i in range(0, len(pairs), chunksize)]
+		shared = (dates, price, mas, self.dd, self.openend)
+		if self.workers == 1:
+			_initWorker(*shared)
+			gains = [_evaluatePairs(task) for task in tasks]
+		else:
+			with ProcessPoolExecutor(max_workers=self.workers, initializer=_initWorker, initargs=shared) as pool:
+				gains = list(pool.map(_evaluatePairs, tasks))
+		gains = np.concatenate(gains) if gains else np.empty((0, 2))
+
+		invested = self.bf.calcPIPFI(dates, price)
+
+		results = np.empty(len(pairs), dtype=resultType)
+		results['avgtype'] = [a for a, nl, nh in pairs]
+		results['nl'] = [nl for a, nl, nh in pairs]
+		results['nh'] = [nh for a, nl, nh in pairs]
+		results['signals'] = gains[:, 1]
+		results['invested'] = invested[0]
+		results['investedpct'] = invested[1]
+		results['signaled'] = gains[:, 0]
+		results['signaledpct'] = 100*gains[:, 0]/price[0]
+
+		return results[np.argsort(-results['signaledpct'], kind='stable')]
+
+	# Choose the best pair on rolling train windows and evaluate it on the following test windows,
+	# returning the per-window choices and the stitched out-of-sample equity curves:
+	def walkForward(self, nls, nhs, train, test, avgtype='EWMA'):
+		windows = sorted(set(nls) | set(nhs))
+		column = {n: i for i, n in enumerate(windows)}
+		pairs = [(column[nl], column[nh]) for nl in nls for nh in nhs if nl < nh]
+
+		# Split the series into train and test slices of the given number of days:
+		bounds = []
+		a = 0
+		while True:
+			b = np.searchsorted(self.dates, self.dates[a] + train)
+			c = np.searchsorted(self.dates, self.dates[b] + test) if b < len(self.dates) else b
+			if c - b < 2 or b - a < 2: break
+			bounds.append((a, b, c))
+			a = np.searchsorted(self.dates, self.dates[a] + test)
+
+		# Compute all moving averages once over the full series so no window loses a warmup period:
+		mas = np.ascontiguousarray(self.bf.movingAverageMatrix(self.price, windows, avgtype))
+		tasks = [(bound, pairs) for bound in bounds]
+		if self.workers == 1:
+			_initWorker(self.dates, self.price, mas, None, self.openend)
+			evaluated = [_evaluateWindow(task) for task in tasks]
+		else:
+			# Share the arrays through shared memory rather than pickling them for every task:
+			blocks = [_shareArray(x) for x in [self.dates, self.price, mas]]
+			try:
+				with ProcessPoolExecutor(max_workers=self.workers, initializer=_initSharedWorker, initargs=tuple(d for shm, d in blocks) + (self.openend,)) as pool:
+					evaluated = list(pool.map(_evaluateWindow, tasks))
+			finally:
+				for shm, d in blocks:
+					shm.close()
+					shm.unlink()
+
+		# Stitch the test slices together, compounding each onto the end of the previous one:
+		results = np.empty(len(bounds), dtype=windowType)
+		t = []; equity = []; invested = []
+		level = 1.; held = 1.
+		for k, ((a, b, c), ((il, ih, trainpct, testpct), curve)) in enumerate(zip(bounds, evaluated)):
+			results[k] = (self.dates[a], self.dates[b], self.dates[c-1], windows[il], windows[ih], trainpct, testpct, 100*(self.price[c-1] - self.price[b])/self.price[b])
+			t.append(self.dates[b:c])
+			equity.append(level*curve)
+			invested.append(held*self.price[b:c]/self.price[b])
+			level = equity[-1][-1]
+			held = invested[-1][-1]
+
+		if not bounds: return results, np.empty(0), np.empty(0), np.empty(0)
+		return results, np.concatenate(t), np.concatenate(equity), np.concatenate(invested)
+
+	def printWindows(self, results):
+		headfmt = "%-10s %-10s %-10s %4s %4s %9s %9s %9s"
+		datafmt = "%-10s %-10s %-10s %4d %4d %+8.2f%% %+8.2f%% %+8.2f%%"
+		print(headfmt % ('Train', 'Test', 'End', 'NL', 'NH', 'Train', 'Signaled', 'Invested'))
+		for r in results:
+			print(datafmt % (self.bf.formatDate(num2date(r['train'])), self.bf.formatDate(num2date(r['test'])), self.bf.formatDate(num2date(r['end'])), r['nl'], r['nh'], r['trainpct'], r['testpct'], r['investedpct']))
+
+	def printResults(self, results, count=20):
+		headfmt = "%4s  %-4s %4s %4s %7s %10s %9s %10s %9s %9s"
+		datafmt = "%4d  %-4s %4d %4d %7d %+10.2f %+8.2f%% %+10.2f %+8.2f%% %+8.2f%%"
+		print(headfmt % ('Rank', 'Type', 'NL', 'NH', 'Signals', 'Invested', '', 'Signaled', '', 'Variance'))
+		for rank, r in enumerate(results[:count]):
+			print(datafmt % (rank+1, r['avgtype'], r['nl'], r['nh'], r['signals'], r['invested'], r['investedpct'], r['signaled'], r['signaledpct'], r['signaledpct'] - r['investedpct']))
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser()
+	parser.add_argument("type", help="can be either tsp or av")
+	parser.add_argument("symbol", help="TSP fund letter or AlphaVantage symbol")
+	parser.add_argument("-y", "--years", help="number of years to backtest", type=float, default=20.)
+	parser.add_argument("-n", "--windows", help="smallest and largest window", type=int, nargs=2, default=[2, 100])
+	parser.add_argument("-s", "--step", help="spacing between windows", type=int, default=2)
+	parser.add_argument("-w", "--workers", help="number of worker processes", type=int, default=None)
+	parser.add_argument("-c", "--count", help="number of results to print", type=int, default=20)
+	parser.add_argument("-f", "--walkforward", help="train and test days for a walk-forward run", type=int, nargs=2, default=None)
+	parser.add_argument("-a", "--avgtype", help="average type used for a walk-forward run", default='EWMA')
+	args = parser.parse_args()
+
+	dts = datetime.now() - timedelta(days=365*args.years)
+	windows = list(range(args.windows[0], args.windows[1]+1, args.step))
+	symbol = args.symbol.upper()
+
+	if args.type == 'tsp':
+		import ThriftSavingsPlan
+		finObj = ThriftSavingsPlan.ThriftSavingsPlan(symbol, dts=dts, nh=max(windows))
+		key = symbol + ' Fund'
+	elif args.type == 'av':
+		import AlphaVantage
+		finObj = AlphaVantage.AlphaVantage(symbol, dts=dts, nh=max(windows))
+		key = 'Close'
+	else:
+		print("Must select one of the following: tsp, av.")
+		sys.exit()
+
+	data = finObj.getData()
+	if data is None:
+		print("Could not retrieve data from remote server for %s." % symbol)
+		sys.exit(1)
+
+	sweep = ParameterSweep(data['Date'], data[key], finObj.dd, finObj.openEnd, workers=args.workers)
+
+	if args.walkforward is None:
+		sweep.printResults(sweep.run(windows, windows), args.count)
+	else:
+		results, t, equity, invested = sweep.walkForward(windows, windows, args.walkforward[0], args.walkforward[1], args.avgtype)
+		sweep.printWindows(results)
+
+		# Plot the out-of-sample equity curve against staying fully invested:
+		imgpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'images', 'sweep')
+		fp = FinancePlot.FinancePlot('Walk-Forward', finObj.dd, imgpath)
+		fp.plotEquity(t, {'Signaled': equity, 'Invested': invested}, symbol)
@@ -0,0 +1,213 @@
+import os, json, tempfile, threading, contextlib
+import numpy as np
+from datetime import datetime
+from urllib.parse import quote
+
+from FinanceDatabase import columns
+
+# Fixed-width record stored for every daily bar, with NaN for values a source does not provide:
+barType = np.dtype([('date', 'datetime64[us]')] + [(col, np.float64) for col in columns.values()])
+
+# Locks serializing the writers of each store directory within this process:
+_locks = {}
+_locksLock = threading.Lock()
+
+# Keep every symbol's bars sorted by date in one file of fixed-width records that is memory-mapped for
+# reads, with a manifest holding each file name, record count and checked time. The manifest is replaced
+# atomically after every write and records past its count are ignored, so an interrupted append leaves
+# the store unchanged. Only one process should write to a store at a time:
+class PriceStore:
+	def __init__(self, path, table):
+		self.path = os.path.join(path, table)
+		self.table = table
+
+		self.manifest = {}
+		self.stamp = None
+		self.maps = {}
+
+		# Instances sharing a directory in this process take turns writing, rereading the manifest first:
+		with _locksLock:
+			self.lock = _locks.setdefault(os.path.abspath(self.path), threading.RLock())
+
+		self.create()
+
+	def create(self):
+		os.makedirs(self.path, exist_ok=True)
+		self.load()
+
+	# Reread the manifest if another writer has replaced it since it was last read:
+	def load(self):
+		filename = os.path.join(self.path, 'manifest.json')
+		try:
+			stamp = os.stat(filename).st_mtime_ns
+		except FileNotFoundError:
+			return
+		if stamp == self.stamp: return
+
+		with open(filename) as fh:
+			self.manifest = json.load(fh)
+		self.stamp = stamp
+
+	# Write a file next to its destination, flush it to disk and move it into place:
+	def _replace(self, filename, data):
+		fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+		try:
+			with os.fdopen(fd, 'wb') as fh:
+				fh.write(data)
+				fh.flush()
+				os.fsync(fh.fileno())
+			os.replace(tmp, filename)
+		except BaseException:
+			os.unlink(tmp)
+			raise
+
+	def _saveManifest(self):
+		filename = os.path.join(self.path, 'manifest.json')
+		self._replace(filename, json.dumps(self.manifest, indent=1, sort_keys=True).encode())
+		self.stamp = os.stat(filename).st_mtime_ns
+
+	# Return the stored records of a symbol as a read-only memory map, or None if there are none:
+	def _records(self, symbol):
+		self.load()
+		entry = self.manifest.get(symbol)
+		if entry is None or entry['count'] == 0: return None
+
+		key = (entry['file'], entry['count'])
+		cached = self.maps.get(symbol)
+		if cached is None or cached[0] != key:
+			recs = np.memmap(os.path.join(self.path, entry['file']), dtype=barType, mode='r', shape=(entry['count'],))
+			self.maps[symbol] = cached = (key, recs)
+		return cached[1]
+
+	# Convert a list of dates to naive microsecond timestamps the way FinanceDatabase stores them:
+	def _dates(self, dates):
+		return np.array([d.replace(tzinfo=None) if isinstance(d, datetime) else d for d in dates], dtype='datetime64[us]')
+
+	# Build records from a quote data dict, leaving columns the dict does not provide as NaN:
+	def _bars(self, data):
+		bars = np.full(len(data['Date']), np.nan, dtype=barType)
+		bars['date'] = self._dates(data['Date'])
+		for k, col in columns.items():
+			if k in data:
+				bars[col] = np.array(data[k], dtype=np.float64)
+		return bars[np.argsort(bars['date'], kind='stable')]
+
+	# Merge new bars into a symbol, either overwriting stored values the new bars provide or ignoring stored dates:
+	def _write(self, symbol, bars, provided, ignore=False):
+		with self.lock:
+			self._merge(symbol, bars, provided, ignore)
+
+	def _merge(self, symbol, bars, provided, ignore):
+		self.load()
+		entry = self.manifest.setdefault(symbol, {'file': None, 'count': 0, 'checked': None})
+		recs = self._records(symbol)
+
+		# Bars strictly after the last stored date are appended to the end of the existing file:
+		if recs is None or len(bars) == 0 or bars['date'][0] > recs['date'][-1]:
+			if entry['file'] is None:
+				entry['file'] = quote(symbol, safe='') + '.0.bin'
+			with open(os.path.join(self.path, entry['file']), 'ab') as fh:
+				fh.truncate(entry['count']*barType.itemsize)
+				fh.write(bars.tobytes())
+				fh.flush()
+				os.fsync(fh.fileno())
+			entry['count'] += len(bars)
+			self._saveManifest()
+			return
+
+		# Otherwise merge in memory and write a new generation of the file before switching the manifest over:
+		merged = np.array(recs)
+		idx = np.searchsorted(merged['date'], bars['date'])
+		hit = idx < len(merged)
+		hit[hit] = merged['date'][idx[hit]] == bars['date'][hit]
+		if not ignore:
+			for col in provided:
+				values = bars[col][hit]
+				valid = ~np.isnan(values)
+				merged[col][idx[hit][valid]] = values[valid]
+		merged = np.concatenate([merged, bars[~hit]])
+		merged = merged[np.argsort(merged['date'], kind='stable')]
+
+		old = entry['file']
+		generation = int(old.rsplit('.', 2)[1]) + 1
+		entry['file'] = quote(symbol, safe='') + '.%d.bin' % generation
+		entry['count'] = len(merged)
+		self._replace(os.path.join(self.path, entry['file']), merged.tobytes())
+		self._saveManifest()
+		os.unlink(os.path.join(self.path, old))
+
+	# Every write is already atomic on its own, so a transaction only groups the calls for FinanceDatabase compatibility:
+	def transaction(self):
+		return contextlib.nullcontext(self)
+
+	def insert(self, symbol, date, close):
+		self.insertAll(symbol, [date], [close])
+
+	def insertAll(self, symbol, date, close):
+		self._write(symbol, self._bars({'Date': date, 'Close': close}), ['close'], ignore=True)
+
+	# Insert or update every bar in a quote data dict, keeping stored values for any column the new data does not provide:
+	def upsertBars(self, symbol, data):
+		self._write(symbol, self._bars(data), [columns[k] for k in columns if k in data])
+
+	def setChecked(self, symbol, checked):
+		with self.lock:
+			self.load()
+			self.manifest.setdefault(symbol, {'file': None, 'count': 0, 'checked': None})['checked'] = checked.isoformat()
+			self._saveManifest()
+
+	def getChecked(self, symbol):
+		self.load()
+		entry = self.manifest.get(symbol)
+		if entry is None or entry['checked'] is None: return None
+		return datetime.fromisoformat(entry['checked'])
+
+	def fetchSymbols(self):
+		self.load()
+		return sorted(symbol for symbol, entry in self.manifest.items() if entry['count'] > 0)
+
+	def fetch(self, symbol, date):
+		recs = self._records(symbol)
+		if recs is None: return None
+		date = self._dates([date])[0]
+		k = np.searchsorted(recs['date'], date)
+		if k == len(recs) or recs['date'][k] != date: return None
+		return {'Date': recs['date'][k].astype(object), 'Close': float(recs['close'][k])}
+
+	def fetchAll(self, symbol):
+		recs = self._records(symbol)
+		if recs is None: return None
+		return {'Date': tuple(recs['date'].astype(object)), 'Close': tuple(recs['close'].tolist())}
+
+	# Return the slice of records between two dates, leaving out any bound that is None:
+	def _range(self, symbol, dts, dte):
+		recs = self._records(symbol)
+		if recs is None: return None
+		lo = 0 if dts is None else np.searchsorted(recs['date'], self._dates([dts])[0], 'left')
+		hi = len(recs) if dte is None else np.searchsorted(recs['date'], self._dates([dte])[0], 'right')
+		return recs[lo:hi]
+
+	# Fetch bars for one symbol between two dates as NumPy arrays viewing the mapped file, with NaN for missing values:
+	def fetchRange(self, symbol, dts=None, dte=None, names=None):
+		if names is None: names = ['Close']
+		recs = self._range(symbol, dts, dte)
+		if recs is None or len(recs) == 0: return None
+
+		data = {'Date': recs['date']}
+		for k in names:
+			data[k] = recs[columns[k]]
+		return data
+
+	# Fetch one column for several symbols between two dates as a (dates x symbols) matrix with NaN gaps:
+	def fetchMatrix(self, symbols, dts=None, dte=None, name='Close'):
+		ranges = [self._range(symbol, dts, dte) for symbol in symbols]
+		ranges = [np.zeros(0, dtype=barType) if recs is None else recs for recs in ranges]
+
+		dates = np.unique(np.concatenate([recs['date'] for recs in ranges]))
+		matrix = np.full((len(dates), len(symbols)), np.nan)
+		for k, recs in enumerate(ranges):
+			matrix[np.searchsorted(dates, recs['date']), k] = recs[columns[name]]
+		return dates, matrix
+
+	def close(self):
+		self.maps = {}
@@ -0,0 +1,72 @@
+import time, sqlite3, threading
+
+class RateLimitError(Exception):
+	pass
+
+# Token buckets for one API whose levels are kept in SQLite, so every process using the same file shares
+# one request budget. Each bucket is a (requests, seconds) pair that refills continuously, and a request
+# is granted only when every bucket holds a token. Checking and taking tokens happens inside an
+# immediate transaction, which serializes concurrent processes:
+class RateLimiter:
+	def __init__(self, filename, name, buckets):
+		self.filename = filename
+		self.name = name
+		self.buckets = buckets
+
+		# Threads of one process share the connection, taking turns through the lock:
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(filename, timeout=60.0, isolation_level=None, check_same_thread=False)
+		self.db.execute("CREATE TABLE IF NOT EXISTS buckets(name TEXT NOT NULL, period REAL NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY(name, period))")
+
+	# Return the refilled level of every bucket at the given time:
+	def levels(self, now):
+		stored = {period: (tokens, updated) for period, tokens, updated in self.db.execute("SELECT period, tokens, updated FROM buckets WHERE name=?", (self.name, ))}
+		levels = []
+		for capacity, period in self.buckets:
+			if period in stored:
+				tokens, updated = stored[period]
+				tokens = min(capacity, tokens + max(0., now - updated)*capacity/period)
+			else:
+				tokens = capacity
+			levels.append(tokens)
+		return levels
+
+	def store(self, levels, now):
+		self.db.executemany("INSERT OR REPLACE INTO buckets(name, period, tokens, updated) VALUES(?,?,?,?)",
+		                    [(self.name, period, tokens, now) for (capacity, period), tokens in zip(self.buckets, levels)])
+
+	# Take one token from every bucket, sleeping only as long as the emptiest bucket needs to refill.
+	# Raise RateLimitError instead if that would take longer than maxwait seconds, and return the time waited:
+	def acquire(self, maxwait=None):
+		waited = 0.
+		while True:
+			with self.lock:
+				self.db.execute("BEGIN IMMEDIATE")
+				try:
+					now = time.time()
+					levels = self.levels(now)
+					wait = max([(1. - tokens)*period/capacity for (capacity, period), tokens in zip(self.buckets, levels)] + [0.])
+					if wait <= 0.:
+						self.store([tokens - 1. for tokens in levels], now)
+				finally:
+					self.db.execute("COMMIT")
+
+			if wait <= 0.: return waited
+			if maxwait is not None and waited + wait > maxwait:
+				raise RateLimitError("%s rate limit requires waiting %.0f more seconds" % (self.name, wait))
+			time.sleep(wait)
+			waited += wait
+
+	# Empty the bucket of the given period after the server reports throttling, so every process backs off:
+	def drain(self, period):
+		with self.lock:
+			self.db.execute("BEGIN IMMEDIATE")
+			try:
+				now = time.time()
+				levels = self.levels(now)
+				self.store([0. if p == period else tokens for (c, p), tokens in zip(self.buckets, levels)], now)
+			finally:
+				self.db.execute("COMMIT")
+
+	def close(self):
+		self.db.close()
@@ -1,11 +1,11 @@
-import os, sys, csv, glob, time
+import os, sys, csv, glob
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 from dateutil import tz
 
-from AlphaVantage import AlphaVantage
+from AlphaVantage import AlphaVantage, appendQuotes
 
 def sign(val):
     if   val < 0.0: return -1
@@ -100,6 +100,33 @@ def parse_positions(csvdata):
             positions['Sweep'].append(row)
     return positions
 
+def read_transactions(trnfile, delim=","):
+    with open(trnfile) as fh:
+        csvread = csv.reader(remove_trailing_delims(fh, delim), delimiter=delim, quotechar='"')
+        csvdata = []
+        for i, row in enumerate(csvread):
+            if i == 0:
+                csvinfo = ','.join([x.replace("  ", " ") for x in row])
+                continue
+            elif i == 1:
+                row.insert(1, "Effective")
+                csvhead = row
+                continue
+            elif len(row) == 8:
+                dateinfo = row[0].split(" as of ")
+                row[0] = dateinfo[0]
+                if len(dateinfo) == 1: row.insert(1, "")
+                else:                  row.insert(1, dateinfo[1])
+                for i in range(5, 9, 1):
+                    try:               row[i] = float(row[i].replace('$', ''))
+                    except ValueError: row[i] = 0.0
+            else:
+                print("Warning on row %d of input file!" % i)
+                continue
+            csvdata.append(row)
+        csvtail = csvdata.pop()
+    return csvinfo, csvhead, csvdata, csvtail
+
 def print_file_info(trnfile, posfile, balfile):
     lentrnfile = 0; lenposfile = 0; lenbalfile = 0
     if trnfile is not None: lentrnfile = len(trnfile)
@@ -291,36 +318,23 @@ if __name__ == "__main__":
 
     print_file_info(trnfile, posfile, balfile)
 
-    with open(trnfile) as fh:
-        csvread = csv.reader(remove_trailing_delims(fh, delim), delimiter=delim, quotechar='"')
-        csvdata = []
-        for i, row in enumerate(csvread):
-            if i == 0:
-                csvinfo = ','.join([x.replace("  ", " ") for x in row])
-                continue
-            elif i == 1:
-                row.insert(1, "Effective")
-                csvhead = row
-                continue
-            elif len(row) == 8:
-                dateinfo = row[0].split(" as of ")
-                row[0] = dateinfo[0]
-                if len(dateinfo) == 1: row.insert(1, "")
-                else:                  row.insert(1, dateinfo[1])
-                for i in range(5, 9, 1):
-                    try:               row[i] = float(row[i].replace('$', ''))
-                    except ValueError: row[i] = 0.0
-            else:
-                print("Warning on row %d of input file!" % i)
-                continue
-            csvdata.append(row)
-        csvtail = csvdata.pop()
+    csvinfo, csvhead, csvdata, csvtail = read_transactions(trnfile, delim)
 
     #print_csvdata(csvdata, csvinfo, csvhead, csvtail)
     contdate, contvalu, conttotl = parse_contribs(csvdata, csvinfo)
 
     TS = []; VS = []
     positions = parse_positions(csvdata)
+
+    # Load the daily prices of every position, then request the latest quotes of the open end funds needing them together:
+    avs = {}
+    if avenable:
+        for symbol in positions:
+            if symbol == 'Sweep': continue
+            try:
+                avs[symbol] = AlphaVantage(symbol, dts=datetime.strptime(positions[symbol][-1][0], "%m/%d/%Y"), dte=datetime.strptime(" ".join(csvinfo.split()[-3:-1]), "%m/%d/%Y %H:%M:%S"), quote=False)
+            except KeyError: pass
+        appendQuotes(avs.values())
     shareplot = {}
     basisplot = {}
     valueplot = {}
@@ -368,12 +382,7 @@ if __name__ == "__main__":
         print(center_string("", 108, "=", False))
 
         avdata = None
-        if symbol == 'Sweep': pass
-        elif avenable:
-            try:
-                av = AlphaVantage(symbol, dts=datetime.strptime(positions[symbol][-1][0], "%m/%d/%Y"), dte=datetime.strptime(" ".join(csvinfo.split()[-3:-1]), "%m/%d/%Y %H:%M:%S"))
-                avdata = av.getData()
-            except KeyError: pass
+        if symbol in avs: avdata = avs[symbol].getData()
 
         if not avenable:        print(center_string("AlphaVantage Data Disabled!", 108, "=", True))
         elif symbol == 'Sweep': print(center_string("AlphaVantage Data Not Available for Bank Sweep", 108, "=", True))
@@ -427,11 +436,6 @@ if __name__ == "__main__":
             plt.ylabel("Value ($)")
             plt.legend()
 
-        if avdata is not None:
-            sleepsecs = 60. / 5
-            print("\nWaiting for AlphaVantage rate limit ...")
-            time.sleep(sleepsecs)
-
     #valuetotal = 0.
     #for symbol in basisplot.keys():
     #    valuetotal += valueplot[symbol]['v'][-1]
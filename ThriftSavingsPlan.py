@@ -1,16 +1,18 @@
-import requests, pandas, os, sys
+import pandas, os, sys
+import numpy as np
 from matplotlib.dates import date2num, num2date
 from datetime import datetime, timedelta
 from io import StringIO
 
-import BasicFinance, FinanceDatabase, FinancePlot
+import BasicFinance, FinanceDatabase, FinancePlot, FinanceHTTP
 
 class ThriftSavingsPlan:
 	def __init__(self, fund, dts = datetime.now() - timedelta(days=365), dte = datetime.now(), nl = 10, nh = 30):
 		self.bf = BasicFinance.BasicFinance()
-		#self.fd = FinanceDatabase.FinanceDatabase(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'finance.db'), 'ThriftSavingsPlan')
+		self.fd = FinanceDatabase.openStore(os.path.dirname(os.path.realpath(__file__)), 'ThriftSavingsPlan')
 
 		self.fund = fund
+		self.column = fund + ' Fund'
 
 		self.dts = dts
 		self.dte = dte
@@ -25,6 +27,7 @@ class ThriftSavingsPlan:
 		self.dtp = self.dte - timedelta(days=self.dd+7.0/5.0*self.nh+self.dd/30.0*3.0) # Take weekends and holidays into account
 
 		self.data = None
+		self.stored = None
 
 		self.update()
 
@@ -35,59 +38,91 @@ class ThriftSavingsPlan:
 	def getData(self):
 		return self.data
 
-	def fetchData(self):
-		return False
-
-		#data = self.fd.fetchAll(self.fund)
-		#if data is None: return False
-
-		#data[self.fund] = data.pop('Close')
-
-		#dateFormat = '%D'
+	# Read every stored fund over the requested window into a dictionary keyed like the CSV columns:
+	def readData(self):
+		symbols = self.fd.fetchSymbols()
+		if self.column not in symbols: return None
+
+		dates, prices = self.fd.fetchMatrix(symbols, self.dtp, self.dte)
+		data = {'Date': dates.astype(object).tolist()}
+		for k, symbol in enumerate(symbols):
+			data[symbol] = prices[:, k].tolist()
+		return data
+
+	# Return the trading days in the window, starting at the first midnight the stored window includes:
+	def expectedDays(self):
+		exps = self.bf.getFederalTradingDays(self.dtp.date(), self.dte.date()).values.astype('datetime64[D]')
+		return exps[exps >= np.datetime64(self.dtp, 'us')]
+
+	# Return the last day with a stored price for this fund, or None if the stored prices do not reach back to the window start:
+	def lastStored(self):
+		if self.stored is None: return None
+		acts = np.array(self.stored['Date'], dtype='datetime64[D]')[np.isfinite(self.stored[self.column])]
+		exps = self.expectedDays()
+		if len(acts) == 0 or (len(exps) > 0 and acts[0] > exps[0]): return None
+		return acts[-1]
 
-		#ret = True
-
-		#for act, exp in zip(data['Date'], [ts.to_pydatetime() for ts in self.bf.getFederalTradingDays(self.dtp, self.dte)]):
-		#	if act.strftime(dateFormat) != exp.strftime(dateFormat):
-		#		ret = False
-
-		#if ret: self.data = data
-
-		#return ret
+	def fetchData(self):
+		# Attempt to read in data from database:
+		data = self.stored = self.readData()
+		last = self.lastStored()
+		if last is None: return False
+
+		# Determine trading days with a final price newer than the last one stored:
+		exps = self.expectedDays()
+		exps = exps[(exps > last) & (exps <= self.bf.settledDay(datetime.now()))]
+
+		# Ignore days without a price older than the newest price of the last download, which were never published:
+		checked = self.fd.getChecked(self.column)
+		if checked is not None:
+			exps = exps[exps >= np.datetime64(checked.date(), 'D')]
+
+		# If new prices are available, download:
+		if len(exps) > 0:
+			return False
+		else:
+			self.data = data
+			return True
 
 	# POST values to remote webserver and download CSV reply:
 	def downloadData(self):
+		# Only request dates newer than the last stored price:
+		last = self.lastStored()
+		if last is None: dts = self.dtp
+		else:            dts = (last + 1).astype(object)
+
 		dateFormat = '%Y-%m-%d'
 		url = 'https://www.tsp.gov/data/fund-price-history.csv'
-		data = {'startdate': self.dtp.strftime(dateFormat), 'enddate': self.dte.strftime(dateFormat), 'Lfunds': '1', 'InvFunds': '1', 'download': '1'}
+		data = {'startdate': dts.strftime(dateFormat), 'enddate': self.dte.strftime(dateFormat), 'Lfunds': '1', 'InvFunds': '1', 'download': '1'}
 		head = {'User-agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:30.0)',
 		        'referer':    'https://www.tsp.gov/share-price-history/'}
-		response = requests.get(url, params=data, headers=head)
+		try:
+			response = FinanceHTTP.get(url, params=data, headers=head, cache='tsp-prices', valid=lambda r: r.content.lstrip().startswith(b'Date'))
+		except FinanceHTTP.OfflineError as e:
+			print(e)
+			response = None
 
-		if response.status_code == 200:
+		if response is not None and response.status_code == 200:
 			# Read in dataframe from CSV response and sort by date:
 			df = pandas.read_csv(StringIO(response.text))
 			df = df[df.Date.notnull()]
 			df['date'] = pandas.to_datetime(df['Date'], format='%Y-%m-%d')
 			df = df.sort_values('date')
-			df = df[df.date.between(self.dtp, self.dte)]
 
-			# Clean up text in dataframe and create a dictionary:
-			data = {}
-			for k, v in df.to_dict('list').items():
-				kn = k.strip()
-				if len(kn) > 0:
-					data[kn] = v
-
-			# Convert Pandas timestamps to datetime objects:
-			data['Date'] = [ts.to_pydatetime() for ts in data['date']]
-			del data['date']
-
-			self.data = data
-
-			#for k, v in data.items():
-			#	if k == 'Date': continue
-			#	self.fd.insertAll(k, self.data['Date'], self.data[k])
+			# Store every fund column from this one download in one transaction so other funds and later runs are served
+			# locally, noting the newest price of each fund so that only days after it are requested again:
+			with self.fd.transaction():
+				for k in df.columns:
+					kn = k.strip()
+					if len(kn) == 0 or kn in ['Date', 'date']: continue
+					prices = pandas.to_numeric(df[k], errors='coerce')
+					valid = prices.notnull()
+					if not valid.any(): continue
+					dates = [ts.to_pydatetime() for ts in df['date'][valid]]
+					self.fd.upsertBars(kn, {'Date': dates, 'Close': prices[valid].tolist()})
+					self.fd.setChecked(kn, dates[-1])
+
+			self.data = self.readData()
 
 		else:
 			self.data = None
@@ -111,16 +146,44 @@ class ThriftSavingsPlan:
 
 if __name__ == "__main__":
 
-	if len(sys.argv) < 2:
+	# Summarize all funds from one batch computation instead of plotting each fund:
+	batch = '--batch' in sys.argv
+
+	# Serve every request from the response cache:
+	if '--offline' in sys.argv: FinanceHTTP.client.offline = True
+
+	# Keep prices in the memory-mapped store instead of finance.db:
+	if '--memmap' in sys.argv: FinanceDatabase.backend = 'memmap'
+
+	args = [arg for arg in sys.argv[1:] if arg not in ['--batch', '--offline', '--memmap']]
+
+	if len(args) < 1:
 		funds = ['G', 'F', 'C', 'S', 'I']
 	else:
-		funds = sys.argv[1:]
+		funds = args
 
 	funds = [fund.upper() for fund in funds]
 
 	# Define image path in same directory as this script:
 	imgpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'images', 'tsp')
 
+	if batch:
+		TSP = ThriftSavingsPlan(funds[0])
+		data = TSP.getData()
+
+		# If data cannot be retreived, exit the program with an error:
+		if data is None:
+			print("Could not retrieve data from remote server.")
+			sys.exit(1)
+
+		# Compute signals for every fund column in one pass:
+		prices = np.array([data[fund + ' Fund'] for fund in funds], dtype=np.float64).T
+		results = TSP.bf.batchSignals(date2num(data['Date']), prices, TSP.nl, TSP.nh, TSP.dd, 'EWMA', TSP.openEnd, [fund + ' Fund' for fund in funds])
+
+		fp = FinancePlot.FinancePlot('Thrift Savings Plan', TSP.dd, imgpath)
+		fp.printBatchSignals(results)
+		sys.exit()
+
 	for fund in funds:
 		TSP = ThriftSavingsPlan(fund)
 		data = TSP.getData()
@@ -1,4 +1,4 @@
-import requests, json, sys, re, os
+import json, sys, re, os
 import numpy as np
 from datetime import date, datetime, timedelta
 import matplotlib.pyplot as plt
@@ -10,6 +10,7 @@ register_matplotlib_converters()
 
 # Import convenience functions from Schwab.py
 from Schwab import add_series, remove_duplicates
+import FinanceHTTP
 
 # Create a file called auth.py containing a definition for the token
 try: from FinanceAuth import tokenYNAB as token
@@ -46,8 +47,11 @@ if trantout >= 60: apicalls += 1.
 else:              apicalls += 60./trantout
 if apicalls > 200: print("[WARN] Rate of %.0f API calls per hour will be limited!" % apicalls)
 
-# Check for API token
-if token is None:
+# Serve every request from the response cache?
+if '--offline' in sys.argv: FinanceHTTP.client.offline = True
+
+# Check for API token, which is not needed to replay cached responses
+if token is None and not FinanceHTTP.client.offline:
     print("Please request a Personal Access Token from YNAB and define in auth.py as follows:")
     print('    token = "XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"')
     exit(1)
@@ -68,7 +72,7 @@ def print_json(j):
 # Parameter 'token' is the API token loaded in earlier
 def ynab_request(endpoint, token):
     h = {'Authorization' : "Bearer %s" % token}
-    r = requests.get("https://api.youneedabudget.com/v1/%s" % '/'.join(endpoint), headers=h)
+    r = FinanceHTTP.get("https://api.youneedabudget.com/v1/%s" % '/'.join(endpoint), headers=h, cache='ynab')
     use, tot = [int(x) for x in r.headers['X-Rate-Limit'].split('/')]
     if (tot - use)/tot < 0.5:
         print("[WARN] Over 50% of hourly requests used! (%d left)" % (tot - use))